@@ -1,11 +1,21 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, simpledialog, colorchooser, Label
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, ImageOps, ImageSequence
+from PIL.PngImagePlugin import PngInfo
 import os
-from rembg import remove
+from rembg import new_session
+from rembg.sessions import sessions_class
 import dotenv
 import threading
+import queue
 import subprocess
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import io
+import onnxruntime as ort
 from ttkthemes import ThemedTk
 import numpy as np
 import face_recognition
@@ -13,7 +23,18 @@ import httpx
 import psutil
 import hashlib
 import webbrowser
+import sys
 import json  # For storing license data in JSON format
+import argparse
+import glob
+import tempfile
+import itertools
+import math
+import re
+import time
+import struct
+import mmap
+import zlib
 
 # Load environment variables (if you want to store DEFAULT_SAVE_PATH in .env)
 dotenv.load_dotenv()
@@ -22,6 +43,2643 @@ DEFAULT_SAVE_PATH = os.getenv('DEFAULT_SAVE_PATH', os.path.expanduser("~/Process
 # Point to your server’s validation endpoint:
 WEB_APP_URL = "http://127.0.0.1:5001"  # Adjust as needed
 
+# rembg model used for background removal and the Smart Crop fallback
+DEFAULT_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+
+# Selectable model tiers: (model name, menu label), fastest first
+MODEL_TIERS = [
+    ("u2netp", "Fast - u2netp (thumbnails)"),
+    ("silueta", "Fast - silueta (catalog previews)"),
+    ("u2net", "Standard - u2net"),
+    ("u2net_human_seg", "People - u2net_human_seg"),
+    ("isnet-general-use", "High Quality - isnet (hero shots)"),
+]
+BENCHMARK_SAMPLE_SIZE = 10
+
+# Dynamically quantized INT8 variants are cached next to the FP32 model as
+# <name>.int8.onnx and selected with a "-int8" suffix, e.g. "u2netp-int8"
+INT8_SUFFIX = "-int8"
+
+# Worker processes for Process Images (1 = run in the GUI's worker thread)
+PHYSICAL_CORES = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+PROCESS_WORKERS = max(1, int(os.getenv('PROCESS_WORKERS', '1')))
+
+# Smart Crop finds its subject with a cascade of localizers, cheapest first;
+# the first stage whose confidence (0-1) reaches its threshold wins. "saliency"
+# is a colour-distance-to-backdrop box (product shots on plain backgrounds),
+# "mask-lowres" runs LOWRES_MASK_MODEL on a LOWRES_MASK_SIDE px copy and
+# "mask" is the job model at full resolution.
+LOCALIZER_STAGES = tuple(os.getenv('LOCALIZER_STAGES', 'face,saliency,mask-lowres,mask').split(','))
+LOCALIZER_MIN_CONFIDENCE = {
+    "face": 0.5,
+    "saliency": float(os.getenv('SALIENCY_MIN_CONFIDENCE', '0.7')),
+    "mask-lowres": float(os.getenv('LOWRES_MASK_MIN_CONFIDENCE', '0.95')),
+    "mask": 0.0,
+}
+SALIENCY_SIDE = 192
+SALIENCY_MIN_CONTRAST = 30.0
+LOWRES_MASK_MODEL = os.getenv('LOWRES_MASK_MODEL', 'u2netp')
+LOWRES_MASK_SIDE = 640
+
+# Ratios of the Smart Crop menu, written together by "All Four Ratios"
+CATALOG_CROP_RATIOS = ((1, 1), (4, 6), (16, 9), (3, 2))
+
+# Smart Crop on several images: face detection (dlib HOG, one core per call)
+# runs on a pool of FACE_WORKERS processes; images without a face go to a
+# separate pool holding the rembg session so they never block the face pool
+FACE_WORKERS = max(1, int(os.getenv('FACE_WORKERS', str(PHYSICAL_CORES))))
+SMART_CROP_MASK_WORKERS = max(1, int(os.getenv('SMART_CROP_MASK_WORKERS', '1')))
+
+# Operation chains (recipes) run one image per process on CHAIN_WORKERS
+# processes unless a larger worker count is set for the job
+CHAIN_WORKERS = max(1, int(os.getenv('CHAIN_WORKERS', str(PHYSICAL_CORES))))
+
+# Images stacked into one ONNX inference call
+BATCH_SIZE = max(1, int(os.getenv('BATCH_SIZE', '1')))
+BENCHMARK_BATCH_SIZES = (1, 4, 8, 16)
+
+# On-disk mask cache shared by Process Images and Smart Crop (0 MB disables it)
+MASK_CACHE_DIR = os.getenv('MASK_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".smart_remove_bg", "mask_cache"))
+MASK_CACHE_MB = int(os.getenv('MASK_CACHE_MB', '1024'))
+
+# Large-image mode: images above this many megapixels are inferred on a reduced
+# decode and composited back at full resolution in strips (0 disables it)
+LARGE_IMAGE_MP = float(os.getenv('LARGE_IMAGE_MP', '24'))
+PROXY_MAX_SIDE = int(os.getenv('PROXY_MAX_SIDE', '2048'))
+STRIP_BUDGET_MB = int(os.getenv('STRIP_BUDGET_MB', '64'))
+
+# Face detection scale: dlib's HOG window is 80 px, so each image is scaled
+# (never enlarged) until a face FACE_MIN_SIZE of its shorter side fills the
+# window - every detection copy is then ~800 px on its short side, whatever the
+# source size. If nothing is found, one retry with HOG's 2x upsampling
+# (FACE_UPSAMPLE_RETRY) also catches faces half that size. JPEGs are decoded
+# at the detection scale by the codec, like list thumbnails and the preview.
+FACE_MIN_SIZE = float(os.getenv('FACE_MIN_SIZE', '0.1'))
+FACE_UPSAMPLE_RETRY = os.getenv('FACE_UPSAMPLE_RETRY', '1') == '1'
+HOG_WINDOW = 80
+THUMBNAIL_SIDE = 50
+PREVIEW_SIDE = 400
+
+# Output encoders: name -> Pillow format, file extension and save options.
+# "colors" quantizes to a palette first (flat graphics, logos). Streamed
+# outputs (large images, APNG) are always PNG and only take compress_level.
+OUTPUT_ENCODER = os.getenv('OUTPUT_ENCODER', 'png')
+OUTPUT_ENCODERS = {
+    "png-fast": {"label": "PNG - fastest (level 1)", "format": "PNG", "ext": ".png",
+                 "options": {"compress_level": 1}},
+    "png": {"label": "PNG - default (level 6)", "format": "PNG", "ext": ".png",
+            "options": {"compress_level": 6}},
+    "png-small": {"label": "PNG - smallest (level 9, optimize)", "format": "PNG", "ext": ".png",
+                  "options": {"compress_level": 9, "optimize": True}},
+    "png-palette": {"label": "PNG - 256-colour palette", "format": "PNG", "ext": ".png",
+                    "options": {"compress_level": 9}, "colors": 256},
+    "webp-lossless": {"label": "WebP - lossless", "format": "WEBP", "ext": ".webp",
+                      "options": {"lossless": True, "quality": 50, "method": 4}},
+    "webp": {"label": "WebP - lossy (q90, lossless alpha)", "format": "WEBP", "ext": ".webp",
+             "options": {"quality": 90, "alpha_quality": 100, "method": 4}},
+}
+
+# What Process Images writes: the RGBA cutout, or only the alpha mask (8-bit
+# or 1-bit PNG named <name>_mask.png) with the source path and SHA-256 stored
+# in PNG text chunks, to be composited on demand later
+OUTPUT_MODE = os.getenv('OUTPUT_MODE', 'cutout')
+OUTPUT_MODES = {"cutout": "Cutout (RGBA)", "mask": "Mask Only (8-bit)", "mask-1bit": "Mask Only (1-bit)"}
+COMPOSITE_MODES = {"rgba": "_nobg", "cutout": "_cutout", "jpg": "_composite"}
+
+# Animated GIF/APNG/WebP files and numbered frame folders: output container,
+# frame duration for frame folders, and how far (mean grey levels on a 64x64
+# thumbnail) a frame may drift from the last keyframe and still reuse its mask
+ANIMATION_FORMAT = os.getenv('ANIMATION_FORMAT', 'apng')
+ANIMATION_FORMATS = ("apng", "webp", "png-sequence")
+FRAME_SEQUENCE_FPS = float(os.getenv('FRAME_SEQUENCE_FPS', '12'))
+TEMPORAL_REUSE_THRESHOLD = float(os.getenv('TEMPORAL_REUSE_THRESHOLD', '1.5'))
+
+# Guided-filter edge refinement: level -> (radius in model-upscale steps, eps,
+# fitting grid as a fraction of the radius). The model predicts at ~320 px, so
+# the mask's edge blur grows with the image size; finer grids cost more time.
+EDGE_REFINE = os.getenv('EDGE_REFINE', 'off')
+REFINE_LEVELS = {
+    "off": None,
+    "fast": (2.0, 1e-3, 2),
+    "balanced": (2.0, 1e-3, 4),
+    "best": (3.0, 1e-4, 8),
+}
+REFINE_EDGE_GAIN = 2.0
+BENCHMARK_MATTING_SAMPLE_SIZE = 3
+
+# Per-save-folder record of finished outputs, used to skip up-to-date work
+MANIFEST_NAME = ".smart_remove_bg_manifest.jsonl"
+
+# Saved operation chains ("recipes"), one JSON file each, shared by the GUI and the command line
+RECIPES_DIR = os.getenv('RECIPES_DIR', os.path.join(os.path.expanduser("~"), ".smart_remove_bg", "recipes"))
+
+# Opt-in: Rotate/Flip of JPEGs by multiples of 90 degrees only rewrites the EXIF Orientation
+# tag - no pixel decode, no re-encode, and the output stays a JPEG of the same size. The
+# stored pixels are left as they were, so viewers that ignore EXIF show them unrotated.
+ORIENTATION_ONLY = os.getenv('ORIENTATION_ONLY', '0') == '1'
+EXIF_ORIENTATION = 0x0112
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+# Headless command line: accepted inputs and process exit codes
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp")
+EXIT_OK = 0
+EXIT_FAILURES = 1      # some files failed
+EXIT_USAGE = 2         # bad arguments (argparse's own code)
+EXIT_NO_INPUTS = 3
+EXIT_UNLICENSED = 4
+EXIT_INTERRUPTED = 130
+
+# Watch-folder mode: poll interval, how long a file's size and mtime must stay
+# unchanged before it counts as fully written, and files queued for processing
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '1.0'))
+WATCH_SETTLE_SECONDS = float(os.getenv('WATCH_SETTLE_SECONDS', '2.0'))
+WATCH_QUEUE_SIZE = max(1, int(os.getenv('WATCH_QUEUE_SIZE', '8')))
+
+# Local HTTP service: requests arriving within the batching window share one
+# inference call; latency percentiles cover the most recent requests
+SERVE_HOST = os.getenv('SERVE_HOST', '127.0.0.1')
+SERVE_PORT = int(os.getenv('SERVE_PORT', '8765'))
+SERVE_BATCH_WINDOW_MS = float(os.getenv('SERVE_BATCH_WINDOW_MS', '5'))
+SERVE_MAX_BATCH = max(1, int(os.getenv('SERVE_MAX_BATCH', '8')))
+SERVE_MAX_UPLOAD_MB = int(os.getenv('SERVE_MAX_UPLOAD_MB', '64'))
+SERVE_STATS_WINDOW = 10000
+
+# Batches buffered between the read, infer and write stages of Process Images
+PIPELINE_QUEUE_SIZE = max(1, int(os.getenv('PIPELINE_QUEUE_SIZE', '2')))
+
+# Input normalization rembg uses per model: (mean, std, input size)
+U2NET_INPUT = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))
+MODEL_INPUTS = {
+    "u2net": U2NET_INPUT,
+    "u2netp": U2NET_INPUT,
+    "u2net_human_seg": U2NET_INPUT,
+    "silueta": U2NET_INPUT,
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+# ONNX Runtime session tuning: defaults < ort_settings.json < environment
+ORT_SETTINGS_FILE = os.getenv('ORT_SETTINGS_FILE', "ort_settings.json")
+DEFAULT_ORT_SETTINGS = {
+    "intra_op_threads": "auto",
+    "inter_op_threads": "auto",
+    "graph_optimization": "all",
+    "execution_mode": "sequential",
+    "providers": "auto",
+}
+ORT_ENV_VARS = {
+    "intra_op_threads": "ORT_INTRA_OP_THREADS",
+    "inter_op_threads": "ORT_INTER_OP_THREADS",
+    "graph_optimization": "ORT_GRAPH_OPTIMIZATION",
+    "execution_mode": "ORT_EXECUTION_MODE",
+    "providers": "ORT_PROVIDERS",
+}
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def load_ort_settings():
+    settings = dict(DEFAULT_ORT_SETTINGS)
+    if os.path.exists(ORT_SETTINGS_FILE):
+        try:
+            with open(ORT_SETTINGS_FILE, "r") as f:
+                settings.update({k: str(v) for k, v in json.load(f).items() if k in settings})
+        except Exception:
+            pass
+    for key, env_var in ORT_ENV_VARS.items():
+        if os.getenv(env_var):
+            settings[key] = os.getenv(env_var)
+    return settings
+
+
+def save_ort_settings(settings):
+    with open(ORT_SETTINGS_FILE, "w") as f:
+        json.dump(settings, f, indent=2)
+
+
+def build_session_options(settings, workers=1, cores=PHYSICAL_CORES):
+    """
+    Turn ORT settings into (SessionOptions, providers) for one of `workers`
+    concurrent sessions. "auto" thread counts give each worker an equal share
+    of `cores` (all physical cores unless part of them is reserved for other
+    work), so the total never exceeds the CPU count.
+    """
+    sess_opts = ort.SessionOptions()
+    intra = settings["intra_op_threads"]
+    inter = settings["inter_op_threads"]
+    sess_opts.intra_op_num_threads = max(1, cores // workers) if intra == "auto" else int(intra)
+    sess_opts.inter_op_num_threads = 1 if inter == "auto" else int(inter)
+    sess_opts.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[settings["graph_optimization"]]
+    sess_opts.execution_mode = EXECUTION_MODES[settings["execution_mode"]]
+
+    providers = None
+    if settings["providers"] != "auto":
+        providers = [p.strip() for p in settings["providers"].split(",") if p.strip()]
+    return sess_opts, providers
+
+
+def create_session(model_name, ort_settings, workers=1, cores=PHYSICAL_CORES):
+    sess_opts, providers = build_session_options(ort_settings, workers, cores)
+    kwargs = {"sess_opts": sess_opts}
+    if providers:
+        kwargs["providers"] = providers
+    if not model_name.endswith(INT8_SUFFIX):
+        return new_session(model_name, **kwargs)
+
+    # INT8 models load through rembg's custom-model sessions
+    base_model = base_model_name(model_name)
+    custom_session = "u2net_custom" if MODEL_INPUTS.get(base_model) == U2NET_INPUT else "dis_custom"
+    session = new_session(custom_session, model_path=ensure_quantized_model(base_model), **kwargs)
+    session.model_name = model_name
+    return session
+
+
+def base_model_name(model_name):
+    if model_name.endswith(INT8_SUFFIX):
+        return model_name[:-len(INT8_SUFFIX)]
+    return model_name
+
+
+def _session_class(model_name):
+    return next((sc for sc in sessions_class if sc.name() == model_name), None)
+
+
+def model_path(model_name):
+    """
+    Path of the downloaded FP32 ONNX file, or None if it is not installed.
+    """
+    session_class = _session_class(model_name)
+    if session_class is None:
+        return None
+    fname = f"{model_name}.onnx"
+    if hasattr(session_class, "resolve_existing"):
+        return session_class.resolve_existing(fname)
+    path = os.path.join(session_class.u2net_home(), fname)
+    return path if os.path.exists(path) else None
+
+
+def model_installed(model_name):
+    """
+    True if the model's ONNX file is already downloaded
+    (for INT8 variants, the FP32 model they are quantized from).
+    """
+    return model_path(base_model_name(model_name)) is not None
+
+
+def quantized_model_path(model_name):
+    path = model_path(model_name)
+    if path is None:
+        return None
+    return os.path.splitext(path)[0] + ".int8.onnx"
+
+
+def ensure_quantized_model(model_name):
+    """
+    Return the INT8 model for `model_name`, quantizing (and if needed
+    downloading) the FP32 model the first time.
+    """
+    if model_path(model_name) is None:
+        _session_class(model_name).download_models()
+    int8_path = quantized_model_path(model_name)
+    if not os.path.exists(int8_path):
+        # onnx is only needed to produce the INT8 file, not to run it
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = int8_path + ".tmp"
+        quantize_dynamic(model_path(model_name), tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def mask_iou(mask_a, mask_b, threshold=128):
+    a = np.asarray(mask_a) >= threshold
+    b = np.asarray(mask_b) >= threshold
+    union = np.logical_or(a, b).sum()
+    if union == 0:
+        return 1.0
+    return np.logical_and(a, b).sum() / union
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of the current process.
+    """
+    info = psutil.Process().memory_info()
+    if hasattr(info, "peak_wset"):  # Windows
+        return info.peak_wset
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SessionPool:
+    """
+    Keeps one warm rembg session per model so every inference call reuses it
+    instead of resolving and loading the ONNX model again.
+    Counts how many sessions were created vs. reused. workers is the number
+    of processes holding a pool like this one at once, sharing `cores`, for
+    the "auto" thread split.
+    """
+    def __init__(self, ort_settings=None, workers=1, cores=PHYSICAL_CORES):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.ort_settings = ort_settings or load_ort_settings()
+        self.workers = workers
+        self.cores = cores
+        self.created = 0
+        self.reused = 0
+
+    def configure(self, ort_settings):
+        """
+        Apply new ORT settings; existing sessions are dropped and rebuilt on demand.
+        """
+        self.ort_settings = ort_settings
+        self.clear()
+
+    def get(self, model_name=DEFAULT_MODEL):
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is None:
+                session = create_session(model_name, self.ort_settings, self.workers, self.cores)
+                self._sessions[model_name] = session
+                self.created += 1
+            else:
+                self.reused += 1
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats_text(self):
+        return f"Sessions: {self.created} created, {self.reused} reused"
+
+
+def load_image(filepath):
+    """
+    Open an image upright (EXIF orientation applied) as RGBA.
+    """
+    return ImageOps.exif_transpose(Image.open(filepath)).convert("RGBA")
+
+
+def _model_input(img, mean, std, size):
+    arr = np.asarray(img.convert("RGB").resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+    arr = arr / max(arr.max(), 1e-6)
+    arr = (arr - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+    return arr.transpose((2, 0, 1))
+
+
+def predict_masks(session, images):
+    """
+    Predict one L-mode mask per image, at each image's own size.
+    Images are resized to the model input, stacked into one tensor and run
+    in a single session call. Models with a fixed batch dimension of 1 are
+    run slice by slice, and models without a known input layout fall back to
+    session.predict().
+    """
+    spec = MODEL_INPUTS.get(base_model_name(session.model_name))
+    if spec is None:
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size = spec
+    batch = np.stack([_model_input(img, mean, std, size) for img in images])
+    model_input = session.inner_session.get_inputs()[0]
+    if model_input.shape[0] == 1:
+        preds = np.concatenate([
+            session.inner_session.run(None, {model_input.name: batch[i:i + 1]})[0]
+            for i in range(len(images))
+        ])
+    else:
+        preds = session.inner_session.run(None, {model_input.name: batch})[0]
+
+    masks = []
+    for img, pred in zip(images, preds[:, 0, :, :]):
+        mi, ma = pred.min(), pred.max()
+        pred = (pred - mi) / max(ma - mi, 1e-6)
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+        masks.append(mask.resize(img.size, Image.Resampling.LANCZOS))
+    return masks
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_name(filepath, suffix):
+    """
+    Output file name for `filepath`, e.g. photo.jpg + "_nobg.png" -> photo_nobg.png.
+    """
+    return os.path.splitext(os.path.basename(filepath))[0] + suffix
+
+
+def input_stat(path):
+    """
+    (size, mtime_ns) of an input file, or of a folder of numbered frames
+    (total size, newest frame or folder change).
+    """
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    stats = [os.stat(frame) for frame in frame_sequence_files(path)]
+    return (sum(stat.st_size for stat in stats),
+            max([os.stat(path).st_mtime_ns] + [stat.st_mtime_ns for stat in stats]))
+
+
+def input_sha256(path):
+    if not os.path.isdir(path):
+        return file_sha256(path)
+    digest = hashlib.sha256()
+    for frame in frame_sequence_files(path):
+        digest.update(f"{os.path.basename(frame)}:{file_sha256(frame)}\n".encode())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Append-only record (JSON lines) of finished outputs in a save folder.
+    Each entry holds the input's size, mtime and SHA-256, the operation, its
+    parameters and the output file, so re-runs skip outputs that are still up
+    to date and a batch that was stopped or crashed resumes where it left off.
+    """
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.path = os.path.join(save_path, MANIFEST_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # partial line from a crash
+                    self.entries[entry["output"]] = entry
+
+    def is_up_to_date(self, filepath, operation, params, output_path):
+        entry = self.entries.get(os.path.basename(output_path))
+        if (entry is None or entry["input"] != os.path.abspath(filepath)
+                or entry["operation"] != operation or entry["params"] != json.loads(json.dumps(params))
+                or not os.path.exists(output_path)):
+            return False
+        size, mtime_ns = input_stat(filepath)
+        if entry["size"] != size:
+            return False
+        if entry["mtime_ns"] == mtime_ns:
+            return True
+        # Touched but possibly unchanged (e.g. copied again): compare content
+        if entry["sha256"] == input_sha256(filepath):
+            self.record(filepath, operation, params, output_path)
+            return True
+        return False
+
+    def record(self, filepath, operation, params, output_path):
+        size, mtime_ns = input_stat(filepath)
+        entry = {
+            "input": os.path.abspath(filepath),
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "sha256": input_sha256(filepath),
+            "operation": operation,
+            "params": json.loads(json.dumps(params)),
+            "output": os.path.basename(output_path),
+        }
+        with self._lock:
+            self.entries[entry["output"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class MaskCache:
+    """
+    Content-addressed on-disk cache of predicted masks.
+    Keys hash the image bytes together with the model name and mask parameters,
+    so any job that needs the same mask (Process Images, Smart Crop, another
+    process) gets it without running inference again. Least recently used
+    entries are evicted once the cache grows past its size budget.
+    """
+    def __init__(self, cache_dir=MASK_CACHE_DIR, budget_mb=MASK_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_mb * 1024 ** 2
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, filepath, model_name, **params):
+        digest = hashlib.sha256(file_sha256(filepath).encode())
+        digest.update(json.dumps({"model": model_name, **params}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".png")
+
+    def get(self, key, size=None):
+        """
+        The cached mask, or None. With size given, a mask of any other size
+        is stale and counts as a miss.
+        """
+        path = self._path(key)
+        try:
+            mask = Image.open(path)
+            if size is not None and mask.size != tuple(size):
+                raise OSError("stale mask size")
+            mask.load()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return mask
+
+    def put(self, key, mask):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        mask.save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.budget_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if name.endswith(".png"):
+                    try:
+                        stat = os.stat(os.path.join(dirpath, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, name)))
+        return entries
+
+    def _evict(self):
+        # Drop least recently used masks until we are back under 90% of the budget
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.budget_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+    def stats_text(self):
+        return f"Mask cache: {self.hits} hits, {self.misses} misses"
+
+
+def create_mask_cache(cache_dir=MASK_CACHE_DIR, budget_mb=MASK_CACHE_MB):
+    return MaskCache(cache_dir, budget_mb) if budget_mb > 0 else None
+
+
+def cached_predict_masks(session, filepaths, images, mask_cache=None, **params):
+    """
+    predict_masks() that consults the mask cache first.
+    Only the cache misses go through the model, as one batch.
+    """
+    if mask_cache is None:
+        return predict_masks(session, images)
+
+    keys = [mask_cache.key(filepath, session.model_name, **params) for filepath in filepaths]
+    masks = [mask_cache.get(key, img.size) for key, img in zip(keys, images)]
+    misses = [i for i, mask in enumerate(masks) if mask is None]
+    if misses:
+        for i, mask in zip(misses, predict_masks(session, [images[i] for i in misses])):
+            masks[i] = mask
+            mask_cache.put(keys[i], mask)
+    return masks
+
+
+def _box_sum_axis(arr, radius, axis):
+    n = arr.shape[axis]
+    cumulative = np.cumsum(arr, axis=axis, dtype=np.float64)
+    cumulative = np.insert(cumulative, 0, 0, axis=axis)
+    hi = np.minimum(np.arange(n) + radius + 1, n)
+    lo = np.maximum(np.arange(n) - radius, 0)
+    return np.take(cumulative, hi, axis=axis) - np.take(cumulative, lo, axis=axis), hi - lo
+
+
+def box_mean(arr, radius):
+    """
+    Mean over a (2*radius+1) square window, clipped at the borders.
+    Separable running sums make it O(1) per pixel whatever the radius.
+    """
+    rows, row_counts = _box_sum_axis(arr, radius, 0)
+    total, col_counts = _box_sum_axis(rows, radius, 1)
+    return total / (row_counts[:, None] * col_counts[None, :])
+
+
+def _resize_float(arr, size):
+    return np.asarray(Image.fromarray(arr.astype(np.float32)).resize(size, Image.Resampling.BILINEAR))
+
+
+def guided_filter(guide, src, radius, eps, subsample=1):
+    """
+    Edge-preserving guided filter (He et al.) with a grayscale guide.
+    With subsample > 1 the linear coefficients are fitted on a reduced copy
+    and upsampled (the "fast guided filter"), which keeps large radii cheap.
+    """
+    full_size = (guide.shape[1], guide.shape[0])
+    if subsample > 1:
+        small_size = (max(1, full_size[0] // subsample), max(1, full_size[1] // subsample))
+        small_guide, small_src = _resize_float(guide, small_size), _resize_float(src, small_size)
+        radius = max(1, radius // subsample)
+    else:
+        small_guide, small_src = guide, src
+
+    mean_i = box_mean(small_guide, radius)
+    mean_p = box_mean(small_src, radius)
+    cov_ip = box_mean(small_guide * small_src, radius) - mean_i * mean_p
+    var_i = box_mean(small_guide * small_guide, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a, mean_b = box_mean(a, radius), box_mean(b, radius)
+    if subsample > 1:
+        mean_a, mean_b = _resize_float(mean_a, full_size), _resize_float(mean_b, full_size)
+    return mean_a * guide + mean_b
+
+
+def refine_mask(img, mask, level="balanced"):
+    """
+    Snap the mask's soft edges to the image with a guided filter and a
+    contrast restore.
+    Only the trimap band around the mask boundary is filtered; solid
+    foreground and background are left untouched.
+    """
+    params = REFINE_LEVELS.get(level)
+    if not params:
+        return mask
+    scale, eps, grid = params
+    radius = max(2, round(scale * max(mask.size) / 320))
+
+    alpha = np.asarray(mask, dtype=np.float32) / 255
+    height, width = alpha.shape
+    step = max(1, radius // grid)
+
+    # Trimap unknown band: soft alpha, plus a margin on both sides of the hard
+    # edge. The margin is found on a strided copy, which is plenty for a band.
+    coverage = box_mean((alpha[::step, ::step] > 0.5).astype(np.float32), max(1, radius * 2 // step))
+    near_edge = (coverage > 1e-6) & (coverage < 1 - 1e-6)
+    near_edge = np.repeat(np.repeat(near_edge, step, axis=0), step, axis=1)[:height, :width]
+    band = near_edge | ((alpha > 0.02) & (alpha < 0.98))
+    if not band.any():
+        return mask
+
+    # Filter only the bounding box of the band (plus the filter radius)
+    rows = np.flatnonzero(band.any(axis=1))
+    cols = np.flatnonzero(band.any(axis=0))
+    top, bottom = max(rows[0] - radius, 0), min(rows[-1] + radius + 1, height)
+    left, right = max(cols[0] - radius, 0), min(cols[-1] + radius + 1, width)
+    guide = np.asarray(img.convert("L").crop((left, top, right, bottom)), dtype=np.float32) / 255
+    refined = guided_filter(guide, alpha[top:bottom, left:right], radius, eps, subsample=step)
+
+    region = alpha[top:bottom, left:right]
+    region_band = band[top:bottom, left:right]
+    # The filter aligns the edge with the image but lowers its contrast; restore it
+    region[region_band] = np.clip((refined[region_band] - 0.5) * REFINE_EDGE_GAIN + 0.5, 0, 1)
+    return Image.fromarray((alpha * 255 + 0.5).astype(np.uint8), mode="L")
+
+
+def benchmark_edge_refinement(img, mask, level):
+    """
+    Time guided-filter refinement against rembg's pymatting alpha matting on
+    one image. Edge error is the mean absolute alpha difference from the
+    alpha-matting result inside the boundary band.
+    Returns (refine seconds, matting seconds, raw mask error, refined error).
+    """
+    from rembg.bg import alpha_matting_cutout
+
+    start = time.perf_counter()
+    refined = refine_mask(img, mask, level)
+    refine_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matted = alpha_matting_cutout(img, mask, 240, 10, 10)
+    matting_time = time.perf_counter() - start
+
+    reference = np.asarray(matted.getchannel("A"), dtype=np.float32)
+    raw = np.asarray(mask, dtype=np.float32)
+    band = (raw > 10) & (raw < 240)
+    if not band.any():
+        band = np.ones_like(raw, dtype=bool)
+    raw_error = np.abs(raw - reference)[band].mean() / 255
+    refined_error = np.abs(np.asarray(refined, dtype=np.float32) - reference)[band].mean() / 255
+    return refine_time, matting_time, raw_error, refined_error
+
+
+def cutout(img, mask):
+    return Image.composite(img, Image.new("RGBA", img.size, 0), mask)
+
+
+def encode_image(img, fp, encoder=OUTPUT_ENCODER):
+    """
+    Save img to a path or file object with one of OUTPUT_ENCODERS.
+    """
+    spec = OUTPUT_ENCODERS[encoder]
+    if "colors" in spec:
+        img = img.quantize(spec["colors"], method=Image.Quantize.FASTOCTREE) if img.mode == "RGBA" \
+            else img.convert("RGB").quantize(spec["colors"])
+    img.save(fp, format=spec["format"], **spec["options"])
+
+
+def encoder_extension(encoder=OUTPUT_ENCODER):
+    return OUTPUT_ENCODERS[encoder]["ext"]
+
+
+def png_compress_level(encoder=OUTPUT_ENCODER):
+    """
+    zlib level for the streamed PNG writers (level 6 for non-PNG encoders).
+    """
+    options = OUTPUT_ENCODERS[encoder]["options"]
+    if OUTPUT_ENCODERS[encoder]["format"] != "PNG":
+        return 6
+    return 9 if options.get("optimize") else options.get("compress_level", 6)
+
+
+def benchmark_encoders(images, encoders=OUTPUT_ENCODERS):
+    """
+    Encode every image in memory with each encoder.
+    Returns {encoder: (seconds per image, bytes per image)}.
+    """
+    report = {}
+    encode_image(images[0], io.BytesIO())  # warm-up, so the first encoder isn't charged for it
+    for encoder in encoders:
+        start = time.perf_counter()
+        size = 0
+        for img in images:
+            buffer = io.BytesIO()
+            encode_image(img, buffer, encoder)
+            size += buffer.tell()
+        report[encoder] = ((time.perf_counter() - start) / len(images), size / len(images))
+    return report
+
+
+def encoder_benchmark_images(filepaths, session, mask_cache=None):
+    """
+    Real cutouts (soft alpha edges, transparent background) to benchmark encoders on.
+    """
+    images = [load_image(filepath) for filepath in filepaths]
+    masks = cached_predict_masks(session, filepaths, images, mask_cache)
+    return [cutout(img, mask) for img, mask in zip(images, masks)]
+
+
+def save_cutout(filepath, img, mask, save_path, encoder=OUTPUT_ENCODER):
+    output_path = os.path.join(save_path, output_name(filepath, "_nobg" + encoder_extension(encoder)))
+    encode_image(cutout(img, mask), output_path, encoder)
+    return output_path
+
+
+def mask_source_text(filepath):
+    """
+    PNG text chunks that let a mask-only output find (and verify) its source later.
+    """
+    return {"Source": os.path.abspath(filepath), "Source-SHA256": file_sha256(filepath)}
+
+
+def save_mask(filepath, mask, save_path, output_mode="mask", encoder=OUTPUT_ENCODER):
+    output_path = os.path.join(save_path, output_name(filepath, "_mask.png"))
+    info = PngInfo()
+    for key, value in mask_source_text(filepath).items():
+        info.add_text(key, value)
+    if output_mode == "mask-1bit":
+        mask = mask.point(lambda value: 255 if value >= 128 else 0, mode="1")
+    mask.save(output_path, format="PNG", pnginfo=info, compress_level=png_compress_level(encoder))
+    return output_path
+
+
+def save_result(filepath, img, mask, save_path, encoder=OUTPUT_ENCODER, output_mode=OUTPUT_MODE):
+    if output_mode == "cutout":
+        return save_cutout(filepath, img, mask, save_path, encoder)
+    return save_mask(filepath, mask, save_path, output_mode, encoder)
+
+
+def composite_batch(mask_paths, save_path, mode="rgba", background=(255, 255, 255), encoder=OUTPUT_ENCODER,
+                    batch_size=BATCH_SIZE):
+    """
+    Rebuild outputs from mask-only files written by save_mask. Each mask names its
+    source in a PNG text chunk; masks of the same size are stacked and blended in
+    one numpy pass per batch. mode is one of COMPOSITE_MODES: "rgba" (the usual
+    _nobg cutout), "cutout" (cropped to the subject) or "jpg" (flattened onto
+    background). Returns [(mask_path, output_path, error), ...] in input order.
+    """
+    results = {}
+    groups = {}
+    for mask_path in mask_paths:
+        try:
+            with Image.open(mask_path) as mask:
+                source = mask.text.get("Source")
+                size = mask.size
+            if not source or not os.path.exists(source):
+                raise FileNotFoundError(f"Source image not found for {os.path.basename(mask_path)}: {source}")
+            groups.setdefault(size, []).append((mask_path, source))
+        except Exception as e:
+            results[mask_path] = (mask_path, None, e)
+
+    ext = ".jpg" if mode == "jpg" else encoder_extension(encoder)
+    for size, items in groups.items():
+        for start in range(0, len(items), max(1, batch_size)):
+            batch, images, masks = [], [], []
+            for mask_path, source in items[start:start + max(1, batch_size)]:
+                try:
+                    img = load_image(source)
+                    if img.size != size:
+                        raise ValueError(f"{os.path.basename(source)} no longer matches its mask size")
+                    masks.append(np.asarray(Image.open(mask_path).convert("L"), dtype=np.float32))
+                    images.append(np.asarray(img, dtype=np.float32))
+                    batch.append((mask_path, source))
+                except Exception as e:
+                    results[mask_path] = (mask_path, None, e)
+            if not batch:
+                continue
+            try:
+                rgba = np.stack(images)
+                alpha = np.stack(masks)[..., None] / 255.0
+                if mode == "jpg":
+                    alpha = alpha * rgba[..., 3:] / 255.0
+                    out = rgba[..., :3] * alpha + np.array(background, dtype=np.float32) * (1.0 - alpha)
+                else:
+                    out = rgba * alpha  # same as cutout(): every channel, alpha included, scaled by the mask
+                out = np.clip(out + 0.5, 0, 255).astype(np.uint8)
+            except Exception as e:
+                for mask_path, _ in batch:
+                    results[mask_path] = (mask_path, None, e)
+                continue
+            for (mask_path, source), pixels in zip(batch, out):
+                try:
+                    img = Image.fromarray(pixels)
+                    if mode == "cutout":
+                        img = img.crop(img.getbbox() or (0, 0) + img.size)
+                    output_path = os.path.join(save_path, output_name(source, COMPOSITE_MODES[mode] + ext))
+                    if mode == "jpg":
+                        img.save(output_path, "JPEG", quality=95)
+                    else:
+                        encode_image(img, output_path, encoder)
+                    results[mask_path] = (mask_path, output_path, None)
+                except Exception as e:
+                    results[mask_path] = (mask_path, None, e)
+    return [results[mask_path] for mask_path in mask_paths]
+
+
+class StripPNGWriter:
+    """
+    Writes a PNG strip by strip so the full output never has to exist in memory.
+    Rows use the PNG "Sub" filter, computed with NumPy.
+    """
+    # mode -> (PNG colour type, bytes per pixel for filtering, bit depth)
+    COLOR_TYPES = {"1": (0, 1, 1), "L": (0, 1, 8), "RGB": (2, 3, 8), "RGBA": (6, 4, 8)}
+
+    def __init__(self, path, size, mode="RGBA", compress_level=6, text=None):
+        self.width, self.height = size
+        self.mode = mode
+        color_type, self.channels, bit_depth = self.COLOR_TYPES[mode]
+        self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, bit_depth, color_type, 0, 0, 0))
+        for key, value in (text or {}).items():
+            self._chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1", "replace"))
+
+    def _chunk(self, tag, data):
+        self._file.write(struct.pack(">I", len(data)) + tag + data)
+        self._file.write(struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    def _filtered(self, strip):
+        if self.mode == "1":
+            # Threshold (Pillow's "1" conversion would dither) and pack 8 pixels per byte
+            rows = np.packbits(np.asarray(strip.convert("L")) >= 128, axis=1)
+        else:
+            rows = np.asarray(strip.convert(self.mode)).reshape(strip.height, -1)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # Sub filter
+        filtered[:, 1:self.channels + 1] = rows[:, :self.channels]
+        np.subtract(rows[:, self.channels:], rows[:, :-self.channels], out=filtered[:, self.channels + 1:])
+        return filtered.tobytes()
+
+    def write(self, strip):
+        data = self._compressor.compress(self._filtered(strip))
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+
+class APNGWriter(StripPNGWriter):
+    """
+    Writes an animated PNG frame by frame, so only the frame being compressed
+    is in memory. Every frame replaces the whole canvas (no disposal or
+    blending), so players show exactly the frames written.
+    """
+    def __init__(self, path, size, num_frames, loop=0, compress_level=6):
+        super().__init__(path, size, "RGBA", compress_level)
+        self.compress_level = compress_level
+        self._chunk(b"acTL", struct.pack(">II", num_frames, loop))
+        self._sequence = 0
+        self._frames = 0
+
+    def write_frame(self, frame, duration_ms):
+        self._chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, self.width, self.height, 0, 0,
+                                         max(0, round(duration_ms)), 1000, 0, 0))
+        self._sequence += 1
+        data = zlib.compress(self._filtered(frame), self.compress_level)
+        if self._frames == 0:
+            self._chunk(b"IDAT", data)  # the first frame doubles as the still image
+        else:
+            self._chunk(b"fdAT", struct.pack(">I", self._sequence) + data)
+            self._sequence += 1
+        self._frames += 1
+
+    def close(self):
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+
+class PNGSequenceWriter:
+    def __init__(self, folder, encoder=OUTPUT_ENCODER):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.encoder = encoder
+        self._frames = 0
+
+    def write_frame(self, frame, duration_ms):
+        self._frames += 1
+        encode_image(frame, os.path.join(self.folder, f"frame_{self._frames:05d}{encoder_extension(self.encoder)}"),
+                     self.encoder)
+
+    def close(self):
+        pass
+
+
+def is_large_image(filepath, large_image_mp=LARGE_IMAGE_MP):
+    if large_image_mp <= 0:
+        return False
+    try:
+        with Image.open(filepath) as img:
+            width, height = img.size
+    except OSError:
+        return False  # the normal path reports unreadable files
+    return width * height > large_image_mp * 1_000_000
+
+
+def open_reduced(filepath, max_side):
+    """
+    Decode an upright copy no larger than max_side, using the codec's reduced
+    decode (JPEG draft / Image.reduce) instead of a full-resolution decode.
+    """
+    img = Image.open(filepath)
+    scale = min(1.0, max_side / max(img.size))
+    # JPEG: let the decoder downscale in the DCT domain (to at least the target size)
+    img.draft(None, (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=None)
+    return ImageOps.exif_transpose(img)
+
+
+def open_proxy(filepath, max_side=PROXY_MAX_SIDE):
+    """
+    open_reduced as RGB. Returns (proxy image, full-resolution upright size).
+    """
+    with Image.open(filepath) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    return open_reduced(filepath, max_side).convert("RGB"), (width, height)
+
+
+def benchmark_decode(filepaths):
+    """
+    A full-resolution decode then downscale vs open_reduced, for the list
+    thumbnail, the preview and the face-detection copy. Returns
+    {task: (full seconds, reduced seconds, full bytes, reduced bytes)} per image;
+    bytes are the largest decoded pixel buffer each way.
+    """
+    def full_thumbnail(filepath, side):
+        img = Image.open(filepath)
+        img.load()
+        img.copy().thumbnail((side, side), Image.Resampling.LANCZOS, reducing_gap=None)
+        return pixel_bytes(img)
+
+    def full_face_copy(filepath):
+        img = load_image(filepath)
+        scale = face_detection_scale(img.size)
+        img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.BILINEAR)
+        return pixel_bytes(img)
+
+    def pixel_bytes(img):
+        return len(img.getbands()) * img.width * img.height
+
+    tasks = {
+        "thumbnail": (lambda f: full_thumbnail(f, THUMBNAIL_SIDE),
+                      lambda f: pixel_bytes(open_reduced(f, THUMBNAIL_SIDE))),
+        "preview": (lambda f: full_thumbnail(f, PREVIEW_SIDE),
+                    lambda f: pixel_bytes(open_reduced(f, PREVIEW_SIDE))),
+        # Only the header of the lazily opened image is read; its size picks the scale
+        "face detection": (full_face_copy, lambda f: pixel_bytes(face_detection_image(Image.open(f), f))),
+    }
+    report = {}
+    for task, (full, fast) in tasks.items():
+        row = []
+        for decode in (full, fast):
+            start = time.perf_counter()
+            peak = max(decode(filepath) for filepath in filepaths)
+            row.append(((time.perf_counter() - start) / len(filepaths), peak))
+        report[task] = (row[0][0], row[1][0], row[0][1], row[1][1])
+    return report
+
+
+# EXIF orientation -> transpose that makes the image upright
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class MappedDecode:
+    """
+    Decodes an image into a memory-mapped temporary file instead of process
+    memory, for the large-image strip pass. release() drops the decoded pages
+    from this process (they stay in the file and are read back as strips are
+    cut); it also runs after every block of compressed data the decoder reads,
+    so the decode itself never holds the full image resident. Modes and
+    formats that cannot be decoded this way are loaded normally.
+    """
+    # image mode -> (raw mode of the mapped buffer, bytes per pixel); Pillow keeps RGB as RGBX
+    MODES = {"RGB": ("RGBX", 4), "RGBA": ("RGBA", 4), "CMYK": ("CMYK", 4), "L": ("L", 1)}
+
+    def __init__(self, filepath):
+        self.image = Image.open(filepath)
+        self._file = self._map = None
+        if self.image.mode in self.MODES:
+            rawmode, pixel_bytes = self.MODES[self.image.mode]
+            size = self.image.width * self.image.height * pixel_bytes
+            self._file = tempfile.TemporaryFile(prefix="smart_remove_bg_")
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            target = Image.frombuffer(self.image.mode, self.image.size, self._map, "raw", rawmode, 0, 1)
+            self.image.im = target.im
+            self.image.fp = _ReleasingReader(self.image.fp, self.release)
+            self.image.load()
+            if self.image.im is not target.im:
+                # The plugin made its own image memory (e.g. a memory-mapped raw file)
+                self._close_map()
+        else:
+            self.image.load()
+
+    def release(self):
+        if self._map is not None and hasattr(mmap, "MADV_DONTNEED"):
+            self._map.madvise(mmap.MADV_DONTNEED)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._file = self._map = None
+
+    def close(self):
+        self.image.close()
+        self.image = None
+        self._close_map()
+
+
+class _ReleasingReader:
+    def __init__(self, fp, on_read):
+        self._fp = fp
+        self._on_read = on_read
+
+    def read(self, *args):
+        self._on_read()
+        return self._fp.read(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+def upright_strip(source, orientation, top, bottom):
+    """
+    Rows [top, bottom) of the upright image, cut from the stored (not yet
+    transposed) source, so the full image is never transposed as a whole.
+    """
+    width, height = source.size
+    if orientation in (1, 2):
+        box = (0, top, width, bottom)
+    elif orientation in (3, 4):
+        box = (0, height - bottom, width, height - top)
+    elif orientation in (5, 6):
+        box = (top, 0, bottom, height)
+    else:
+        box = (width - bottom, 0, width - top, height)
+    strip = source.crop(box)
+    if orientation in EXIF_TRANSPOSE:
+        strip = strip.transpose(EXIF_TRANSPOSE[orientation])
+    return strip
+
+
+def remove_background_large(filepath, save_path, session, mask_cache=None, refine="off", encoder=OUTPUT_ENCODER,
+                            output_mode=OUTPUT_MODE):
+    """
+    Large-image mode: infer the mask on a reduced decode, then upscale it and
+    composite the cutout in horizontal strips straight into the output PNG.
+    The full-resolution source is decoded into a memory-mapped file (see
+    MappedDecode), so peak memory stays near STRIP_BUDGET_MB.
+    """
+    proxy, (width, height) = open_proxy(filepath)
+    proxy_mask = cached_predict_masks(session, [filepath], [proxy], mask_cache, proxy=PROXY_MAX_SIDE)[0]
+    # Refining at proxy resolution keeps the large-image path within its memory budget
+    proxy_mask = refine_mask(proxy, proxy_mask, refine)
+    del proxy
+
+    scale_y = proxy_mask.height / height
+    if output_mode != "cutout":
+        # Mask only: the full-resolution source never needs decoding
+        output_path = os.path.join(save_path, output_name(filepath, "_mask.png"))
+        writer = StripPNGWriter(output_path, (width, height), "1" if output_mode == "mask-1bit" else "L",
+                                png_compress_level(encoder), mask_source_text(filepath))
+        strip_height = max(16, STRIP_BUDGET_MB * 1024 ** 2 // (width * 4))
+        try:
+            for top in range(0, height, strip_height):
+                bottom = min(top + strip_height, height)
+                writer.write(proxy_mask.resize((width, bottom - top), Image.Resampling.BILINEAR,
+                                               box=(0, top * scale_y, proxy_mask.width, bottom * scale_y)))
+        finally:
+            writer.close()
+        return output_path
+
+    output_path = os.path.join(save_path, output_name(filepath, "_nobg.png"))
+    with Image.open(filepath) as img:
+        orientation = img.getexif().get(0x0112, 1)
+    # Source crop, RGBA strip, mask, composite and filtered rows: about 24 bytes per pixel
+    strip_height = max(16, STRIP_BUDGET_MB * 1024 ** 2 // (width * 24))
+
+    source = MappedDecode(filepath)
+    writer = StripPNGWriter(output_path, (width, height), compress_level=png_compress_level(encoder))
+    try:
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            mask_strip = proxy_mask.resize(
+                (width, bottom - top), Image.Resampling.BILINEAR,
+                box=(0, top * scale_y, proxy_mask.width, bottom * scale_y)
+            )
+            strip = upright_strip(source.image, orientation, top, bottom).convert("RGBA")
+            source.release()
+            writer.write(cutout(strip, mask_strip))
+    finally:
+        writer.close()
+        source.close()
+    return output_path
+
+
+def natural_key(path):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def frame_sequence_files(folder):
+    return sorted((os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS)),
+                  key=natural_key)
+
+
+def is_animated(filepath):
+    try:
+        with Image.open(filepath) as img:
+            return getattr(img, "is_animated", False)
+    except OSError:
+        return False  # the normal path reports unreadable files
+
+
+def count_frames(source):
+    if os.path.isdir(source):
+        return len(frame_sequence_files(source))
+    with Image.open(source) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def iter_frames(source):
+    """
+    Yields (RGBA frame, duration in ms) from an animated image file or a
+    folder of numbered frames, decoding one frame at a time.
+    """
+    if os.path.isdir(source):
+        for filepath in frame_sequence_files(source):
+            yield load_image(filepath), 1000 / FRAME_SEQUENCE_FPS
+        return
+    with Image.open(source) as img:
+        for frame in ImageSequence.Iterator(img):
+            yield frame.convert("RGBA"), frame.info.get("duration", 1000 / FRAME_SEQUENCE_FPS)
+
+
+def motion_signature(img):
+    return np.asarray(img.convert("L").resize((64, 64), Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+def animation_suffix(animation_format=ANIMATION_FORMAT):
+    """Output suffix of a cutout animation: a folder for PNG sequences, else an APNG or WebP file."""
+    if animation_format == "png-sequence":
+        return "_nobg"
+    return "_nobg.webp" if animation_format == "webp" else "_nobg.png"
+
+
+def animation_output_path(source, save_path, animation_format=ANIMATION_FORMAT):
+    name = os.path.basename(os.path.normpath(source))
+    stem = name if os.path.isdir(source) else os.path.splitext(name)[0]
+    return os.path.join(save_path, stem + animation_suffix(animation_format))
+
+
+def remove_background_animation(source, save_path, session, refine="off", animation_format=ANIMATION_FORMAT,
+                                batch_size=BATCH_SIZE, reuse_threshold=TEMPORAL_REUSE_THRESHOLD, stats=None,
+                                encoder=OUTPUT_ENCODER):
+    """
+    Remove the background of every frame of an animated GIF/APNG/WebP or a
+    folder of numbered frames. Frames are decoded, inferred and written a batch
+    at a time and streamed into an APNG, an animated WebP or a PNG sequence, so
+    the whole animation is never held in memory. A frame that barely differs
+    from the last keyframe reuses its mask instead of running inference.
+    Frame compositing runs in parallel threads. Returns the output path;
+    counts of inferred and reused frames are added to `stats` if given.
+    """
+    output_path = animation_output_path(source, save_path, animation_format)
+    total = count_frames(source)
+    frames = iter_frames(source)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError("No frames found!")
+    size = first[0].size
+    frames = itertools.chain([first], frames)
+
+    if animation_format == "png-sequence":
+        writer = PNGSequenceWriter(output_path, encoder)
+    elif animation_format == "webp":
+        # Stream to a temporary APNG, then let Pillow re-encode it one frame at a time
+        handle, apng_path = tempfile.mkstemp(suffix=".png", dir=save_path)
+        os.close(handle)
+        writer = APNGWriter(apng_path, size, total, compress_level=1)
+    else:
+        writer = APNGWriter(output_path, size, total, compress_level=png_compress_level(encoder))
+
+    counts = {"frames": 0, "inferred": 0, "reused": 0}
+    durations = []
+    key_signature, key_mask = None, None
+    try:
+        with ThreadPoolExecutor(max_workers=PHYSICAL_CORES) as executor:
+            while True:
+                chunk = list(itertools.islice(frames, batch_size))
+                if not chunk:
+                    break
+                keyframes, owners = [], []
+                for img, _ in chunk:
+                    if img.size != size:
+                        raise ValueError(f"Frame size {img.size} differs from the first frame {size}")
+                    signature = motion_signature(img)
+                    if key_signature is None or np.abs(signature - key_signature).mean() > reuse_threshold:
+                        key_signature = signature
+                        keyframes.append(img)
+                    # -1: the keyframe carried over from the previous batch
+                    owners.append(len(keyframes) - 1)
+                masks = predict_masks(session, keyframes) if keyframes else []
+                frame_masks = [masks[owner] if owner >= 0 else key_mask for owner in owners]
+                key_mask = frame_masks[-1]
+
+                images = [img for img, _ in chunk]
+                composited = executor.map(lambda img, mask: cutout(img, refine_mask(img, mask, refine)),
+                                          images, frame_masks)
+                for (_, duration), frame in zip(chunk, composited):
+                    writer.write_frame(frame, duration)
+                    durations.append(duration)
+                counts["frames"] += len(chunk)
+                counts["inferred"] += len(keyframes)
+                counts["reused"] += len(chunk) - len(keyframes)
+        writer.close()
+
+        if animation_format == "webp":
+            with Image.open(apng_path) as animation:
+                animation.save(output_path, format="WEBP", save_all=True, duration=[round(d) for d in durations],
+                               loop=0, lossless=True)
+    finally:
+        if animation_format == "webp" and os.path.exists(apng_path):
+            os.remove(apng_path)
+
+    if stats is not None:
+        for key, value in counts.items():
+            stats[key] = stats.get(key, 0) + value
+    return output_path
+
+
+def remove_background_streamed(filepath, save_path, session, mask_cache=None, refine="off",
+                               animation_format=ANIMATION_FORMAT, encoder=OUTPUT_ENCODER, output_mode=OUTPUT_MODE):
+    """
+    Entry point for inputs that stream their own output instead of going
+    through the batched still-image path: animations and large images.
+    """
+    if is_animated(filepath):
+        if output_mode != "cutout":
+            raise ValueError(f"Animated inputs are written as cutouts only, not in {output_mode} mode.")
+        return remove_background_animation(filepath, save_path, session, refine, animation_format, encoder=encoder)
+    return remove_background_large(filepath, save_path, session, mask_cache, refine, encoder, output_mode)
+
+
+def remove_background_file(filepath, save_path, session, mask_cache=None, refine="off", encoder=OUTPUT_ENCODER,
+                           output_mode=OUTPUT_MODE):
+    """
+    Remove the background of one image and save it as <name>_nobg.png (or .webp),
+    or just its mask as <name>_mask.png.
+    Returns the output path.
+    """
+    img = load_image(filepath)
+    mask = cached_predict_masks(session, [filepath], [img], mask_cache)[0]
+    return save_result(filepath, img, refine_mask(img, mask, refine), save_path, encoder, output_mode)
+
+
+def remove_background_batch(filepaths, save_path, session, mask_cache=None, large_image_mp=LARGE_IMAGE_MP,
+                            refine="off", animation_format=ANIMATION_FORMAT, encoder=OUTPUT_ENCODER,
+                            output_mode=OUTPUT_MODE):
+    """
+    Remove the backgrounds of several images with one batched inference call.
+    Animations and images over large_image_mp megapixels stream their own output instead.
+    Returns a list of (filepath, output_path, error) tuples.
+    """
+    results = []
+    loaded = []
+    for filepath in filepaths:
+        try:
+            if is_animated(filepath) or is_large_image(filepath, large_image_mp):
+                output_path = remove_background_streamed(filepath, save_path, session, mask_cache, refine,
+                                                         animation_format, encoder, output_mode)
+                results.append((filepath, output_path, None))
+            else:
+                loaded.append((filepath, load_image(filepath)))
+        except Exception as e:
+            results.append((filepath, None, e))
+    if not loaded:
+        return results
+
+    try:
+        masks = cached_predict_masks(session, [f for f, _ in loaded], [img for _, img in loaded], mask_cache)
+    except Exception as e:
+        return results + [(filepath, None, e) for filepath, _ in loaded]
+
+    for (filepath, img), mask in zip(loaded, masks):
+        try:
+            mask = refine_mask(img, mask, refine)
+            results.append((filepath, save_result(filepath, img, mask, save_path, encoder, output_mode), None))
+        except Exception as e:
+            results.append((filepath, None, e))
+    return results
+
+
+class Pipeline:
+    """
+    Runs background removal as three stages - decode, inference, PNG
+    encode/write - on their own threads, joined by bounded queues. Disk I/O
+    and zlib compression overlap with inference while only a few batches of
+    decoded images are held in memory. Busy time is tracked per stage so the
+    bottleneck shows up in the utilization readout.
+    """
+    STAGES = ("read", "infer", "write")
+    _DONE = object()
+
+    def __init__(self, should_stop=lambda: False, queue_size=PIPELINE_QUEUE_SIZE):
+        self.should_stop = should_stop
+        self.queue_size = queue_size
+        self.busy = dict.fromkeys(self.STAGES, 0.0)
+        self.elapsed = 0.0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stopped(self):
+        if self.should_stop():
+            self._stopped.set()
+        return self._stopped.is_set()
+
+    def _put(self, q, item):
+        while not self.stopped():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopped():
+                    return self._DONE
+
+    def _read(self, batches, out_q, large_image_mp):
+        for batch in batches:
+            if self.stopped():
+                return
+            start = time.perf_counter()
+            loaded, streamed, failed = [], [], []
+            for filepath in batch:
+                try:
+                    if is_animated(filepath) or is_large_image(filepath, large_image_mp):
+                        streamed.append(filepath)
+                    else:
+                        loaded.append((filepath, load_image(filepath)))
+                except Exception as e:
+                    failed.append((filepath, e))
+            self.busy["read"] += time.perf_counter() - start
+            if not self._put(out_q, (loaded, streamed, failed)):
+                return
+        self._put(out_q, self._DONE)
+
+    def _infer(self, in_q, out_q, save_path, session, mask_cache, refine, animation_format, encoder, output_mode):
+        while True:
+            item = self._get(in_q)
+            if item is self._DONE:
+                break
+            loaded, streamed, failed = item
+            start = time.perf_counter()
+            # (filepath, image, mask, output_path, error)
+            outputs = [(filepath, None, None, None, e) for filepath, e in failed]
+            for filepath in streamed:
+                # Animations and large images stream their own output frame by frame / strip by strip
+                try:
+                    output_path = remove_background_streamed(filepath, save_path, session, mask_cache, refine,
+                                                             animation_format, encoder, output_mode)
+                    outputs.append((filepath, None, None, output_path, None))
+                except Exception as e:
+                    outputs.append((filepath, None, None, None, e))
+            if loaded:
+                try:
+                    masks = cached_predict_masks(session, [f for f, _ in loaded], [img for _, img in loaded],
+                                                 mask_cache)
+                    for (filepath, img), mask in zip(loaded, masks):
+                        outputs.append((filepath, img, refine_mask(img, mask, refine), None, None))
+                except Exception as e:
+                    outputs.extend((filepath, None, None, None, e) for filepath, _ in loaded)
+            self.busy["infer"] += time.perf_counter() - start
+            if not self._put(out_q, outputs):
+                return
+        self._put(out_q, self._DONE)
+
+    def _write(self, in_q, out_q, save_path, encoder, output_mode):
+        while True:
+            item = self._get(in_q)
+            if item is self._DONE:
+                break
+            start = time.perf_counter()
+            results = []
+            for filepath, img, mask, output_path, error in item:
+                if img is not None:
+                    try:
+                        output_path = save_result(filepath, img, mask, save_path, encoder, output_mode)
+                    except Exception as e:
+                        error = e
+                results.append((filepath, output_path, error))
+            self.busy["write"] += time.perf_counter() - start
+            if not self._put(out_q, results):
+                return
+        self._put(out_q, self._DONE)
+
+    def run(self, filepaths, save_path, session, mask_cache=None, large_image_mp=LARGE_IMAGE_MP,
+            refine="off", batch_size=1, animation_format=ANIMATION_FORMAT, encoder=OUTPUT_ENCODER,
+            output_mode=OUTPUT_MODE):
+        """
+        Yields (filepath, output_path, error) as images come out of the write stage.
+        """
+        read_q = queue.Queue(self.queue_size)
+        infer_q = queue.Queue(self.queue_size)
+        result_q = queue.Queue()
+        threads = [
+            threading.Thread(target=self._read, args=(chunked(filepaths, batch_size), read_q, large_image_mp),
+                             daemon=True),
+            threading.Thread(target=self._infer,
+                             args=(read_q, infer_q, save_path, session, mask_cache, refine, animation_format, encoder,
+                                   output_mode),
+                             daemon=True),
+            threading.Thread(target=self._write, args=(infer_q, result_q, save_path, encoder, output_mode),
+                             daemon=True),
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                results = self._get(result_q)
+                if results is self._DONE:
+                    break
+                yield from results
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start
+
+    def utilization(self):
+        return {stage: busy / self.elapsed if self.elapsed else 0.0 for stage, busy in self.busy.items()}
+
+    def utilization_text(self):
+        return " | ".join(f"{stage.capitalize()} {share:.0%}" for stage, share in self.utilization().items())
+
+
+def benchmark_batch_sizes(session, images, batch_sizes=BENCHMARK_BATCH_SIZES):
+    """
+    Measure mask prediction throughput (images/sec) for each batch size.
+    """
+    results = {}
+    predict_masks(session, images[:1])  # warm up
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            predict_masks(session, images[i:i + batch_size])
+        results[batch_size] = len(images) / (time.perf_counter() - start)
+    return results
+
+
+def _benchmark_model_worker(model_name, ort_settings, filepaths):
+    """
+    Runs in a fresh process so the peak RSS belongs to this model alone.
+    Returns (ms per image, peak RSS in bytes).
+    """
+    images = [load_image(f) for f in filepaths]
+    session = create_session(model_name, ort_settings)
+    predict_masks(session, images[:1])  # warm up
+    start = time.perf_counter()
+    for img in images:
+        predict_masks(session, [img])
+    ms_per_image = (time.perf_counter() - start) * 1000 / len(images)
+    return ms_per_image, peak_rss_bytes()
+
+
+def _benchmark_int8_worker(model_name, ort_settings, filepaths):
+    """
+    Compare a model against its INT8 variant on the same images.
+    Returns (fp32 ms/image, int8 ms/image, list of per-image mask IoUs).
+    """
+    images = [load_image(f) for f in filepaths]
+    timings = []
+    all_masks = []
+    for variant in (model_name, model_name + INT8_SUFFIX):
+        session = create_session(variant, ort_settings)
+        predict_masks(session, images[:1])  # warm up
+        start = time.perf_counter()
+        masks = [predict_masks(session, [img])[0] for img in images]
+        timings.append((time.perf_counter() - start) * 1000 / len(images))
+        all_masks.append(masks)
+    ious = [mask_iou(a, b) for a, b in zip(*all_masks)]
+    return timings[0], timings[1], ious
+
+
+def local_license_valid(license_file="license.json"):
+    if not os.path.exists(license_file):
+        return False
+    try:
+        with open(license_file, "r") as f:
+            data = json.load(f)
+        if (data.get("status") == "success" and
+            data.get("message") == "License validated successfully"):
+            return True
+    except Exception:
+        pass
+    return False
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# ---------------------------------------------------------------------
+#      Image operations (shared by the GUI and the command line)
+# ---------------------------------------------------------------------
+def face_detection_scale(size, min_face=FACE_MIN_SIZE):
+    """
+    Scale (at most 1) at which a face min_face of the shorter side of size
+    just fills HOG's detection window.
+    """
+    return min(1.0, HOG_WINDOW / (min_face * min(size)))
+
+
+def face_detection_image(img, filepath=None):
+    """
+    The copy of img that face_box detects on, at face_detection_scale. A JPEG
+    source is decoded again at that scale in the DCT domain, which is far
+    cheaper than resampling the full-resolution img.
+    """
+    scale = face_detection_scale(img.size)
+    if scale >= 1.0:
+        return img
+    side = max(1, round(max(img.size) * scale))
+    if filepath is not None:
+        with Image.open(filepath) as source:
+            is_jpeg = source.format == "JPEG"
+        if is_jpeg:
+            return open_reduced(filepath, side)
+    small = img.copy()
+    small.thumbnail((side, side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return small
+
+
+def detect_face(img, small_img=None, upsample_retry=FACE_UPSAMPLE_RETRY):
+    """
+    First detected face as ((top, right, bottom, left) or None, scale, upsampled).
+    Detection runs on small_img (by default face_detection_image(img)) without
+    upsampling; only if that finds nothing is it retried with 2x upsampling.
+    """
+    if small_img is None:
+        small_img = face_detection_image(img)
+    small_array = np.array(small_img.convert("RGB"))
+    upsampled = False
+    face_locations = face_recognition.face_locations(small_array, number_of_times_to_upsample=0, model="hog")
+    if not face_locations and upsample_retry:
+        upsampled = True
+        face_locations = face_recognition.face_locations(small_array, number_of_times_to_upsample=1, model="hog")
+
+    scale = small_img.width / img.width
+    if face_locations:
+        # Found a face -> scale back up
+        top, right, bottom, left = face_locations[0]
+        scale_x, scale_y = img.width / small_img.width, img.height / small_img.height
+        box = int(top * scale_y), int(right * scale_x), int(bottom * scale_y), int(left * scale_x)
+        return box, scale, upsampled
+    return None, scale, upsampled
+
+
+def face_box(img, small_img=None):
+    """
+    First detected face as (top, right, bottom, left), or None (see detect_face).
+    """
+    return detect_face(img, small_img)[0]
+
+
+def mask_box(mask):
+    """
+    Extent of the non-zero mask pixels as (top, right, bottom, left), inclusive.
+    A PIL mask uses Image.getbbox (one C pass, no copies); an array is reduced
+    with any() per axis. Neither allocates per foreground pixel.
+    """
+    if isinstance(mask, Image.Image):
+        bbox = mask.getbbox()
+        if bbox is None:
+            raise ValueError("No subject detected!")
+        left, top, right, bottom = bbox
+        return top, right - 1, bottom - 1, left
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if len(rows) == 0:
+        raise ValueError("No subject detected!")
+    cols = np.flatnonzero(np.any(mask[rows[0]:rows[-1] + 1], axis=0))
+    return rows[0], cols[-1], rows[-1], cols[0]
+
+
+def saliency_box(img, side=SALIENCY_SIDE):
+    """
+    Subject box from each pixel's colour distance to the backdrop (the median
+    border colour) on a side-px copy, as ((top, right, bottom, left), confidence).
+    Confidence is high for a plain, even backdrop around a compact subject and
+    falls to 0 as the border gets as busy as the subject contrast.
+    """
+    small = img.reduce(max(1, max(img.size) // side)).convert("RGB")
+    arr = np.asarray(small, dtype=np.float32)
+    height, width = arr.shape[:2]
+    b = max(1, min(height, width) // 20)
+    border = np.concatenate([arr[:b].reshape(-1, 3), arr[-b:].reshape(-1, 3),
+                             arr[:, :b].reshape(-1, 3), arr[:, -b:].reshape(-1, 3)])
+    backdrop = np.median(border, axis=0)
+    noise = np.percentile(np.linalg.norm(border - backdrop, axis=1), 95)
+    foreground = np.linalg.norm(arr - backdrop, axis=2) > max(SALIENCY_MIN_CONTRAST, 2 * noise)
+
+    # Rows/columns with at least 1% foreground, so isolated specks don't stretch the box
+    rows = np.flatnonzero(foreground.mean(axis=1) > 0.01)
+    cols = np.flatnonzero(foreground.mean(axis=0) > 0.01)
+    if len(rows) == 0 or len(cols) == 0:
+        return None, 0.0
+    area = (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1) / (height * width)
+    confidence = max(0.0, 1.0 - noise / SALIENCY_MIN_CONTRAST) if 0.01 <= area <= 0.9 else 0.0
+    scale_x, scale_y = img.width / width, img.height / height
+    box = (int(rows[0] * scale_y), int((cols[-1] + 1) * scale_x), int((rows[-1] + 1) * scale_y),
+           int(cols[0] * scale_x))
+    return box, confidence
+
+
+def lowres_mask_box(img, session, filepath=None, mask_cache=None, side=LOWRES_MASK_SIDE):
+    """
+    mask_box of a rembg mask predicted on a side-px copy, as (box, confidence).
+    Confidence is the share of mask pixels that are clearly in or out (below
+    10% or above 90% alpha); an unsure model leaves wide soft regions.
+    """
+    small = img.reduce(max(1, max(img.size) // side))
+    if filepath is not None:
+        mask = cached_predict_masks(session, [filepath], [small], mask_cache, lowres=side)[0]
+    else:
+        mask = predict_masks(session, [small])[0]
+    alpha = np.asarray(mask)
+    if not alpha.any():
+        return None, 0.0
+    top, right, bottom, left = mask_box(mask)
+    scale_x, scale_y = img.width / small.width, img.height / small.height
+    box = (int(top * scale_y), int((right + 1) * scale_x), int((bottom + 1) * scale_y), int(left * scale_x))
+    return box, float(np.mean((alpha < 26) | (alpha > 229)))
+
+
+def _locate_face(img, filepath, get_session, mask_cache):
+    box, scale, upsampled = detect_face(img, face_detection_image(img, filepath))
+    return box, 1.0 if box is not None else 0.0, {"face_scale": round(scale, 3), "face_upsampled": upsampled}
+
+
+def _locate_salient(img, filepath, get_session, mask_cache):
+    return (*saliency_box(img), {})
+
+
+def _locate_lowres_mask(img, filepath, get_session, mask_cache):
+    return (*lowres_mask_box(img, get_session(LOWRES_MASK_MODEL), filepath, mask_cache), {})
+
+
+def _locate_mask(img, filepath, get_session, mask_cache):
+    mask = cached_predict_masks(get_session(), [filepath], [img], mask_cache)[0]
+    try:
+        return mask_box(mask), 1.0, {}
+    except ValueError:  # empty mask
+        return None, 0.0, {}
+
+
+# Localizer stage -> function(img, filepath, get_session, mask_cache) returning
+# (box or None, confidence, details for the job report). Stages that need a
+# session are listed in LOCALIZER_MODEL_STAGES so the process pools can run the
+# rest without one.
+LOCALIZERS = {
+    "face": _locate_face,
+    "saliency": _locate_salient,
+    "mask-lowres": _locate_lowres_mask,
+    "mask": _locate_mask,
+}
+LOCALIZER_MODEL_STAGES = ("mask-lowres", "mask")
+
+
+def localize_subject(img, get_session, filepath=None, mask_cache=None, stages=LOCALIZER_STAGES):
+    """
+    Run the localizer stages in order until one is confident enough. Returns
+    (box or None, trace) where trace is (winning stage or None,
+    [(stage, seconds), ...], merged stage details). get_session(model_name=None)
+    is only called by the model stages, so the models only load when the cheap
+    stages fail.
+    """
+    timings, details = [], {}
+    for stage in stages:
+        start = time.perf_counter()
+        box, confidence, stage_details = LOCALIZERS[stage](img, filepath, get_session, mask_cache)
+        timings.append((stage, time.perf_counter() - start))
+        details.update(stage_details)
+        if box is not None and confidence >= LOCALIZER_MIN_CONFIDENCE[stage]:
+            return box, (stage, timings, details)
+    return None, (None, timings, details)
+
+
+def subject_box(img, get_session, filepath=None, mask_cache=None, stats=None):
+    """
+    Box around the subject from the localizer cascade. stats, if given, is a
+    LocalizerStats that records which stage resolved it.
+    """
+    box, trace = localize_subject(img, get_session, filepath, mask_cache)
+    if stats is not None:
+        stats.add(trace)
+    if box is None:
+        raise ValueError("No subject detected!")
+    return box
+
+
+class LocalizerStats:
+    """
+    Per-job tally of the localizer cascade: images resolved per stage, time per
+    stage, the face-detection scales chosen, and the time saved by not running
+    the full-resolution mask. The saving is estimated from the mean cost of the
+    "mask" stage in this job.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resolved = {}
+        self.seconds = {}
+        self.runs = {}
+        self.early = []  # localization seconds of images resolved before "mask"
+        self.face_scales = {}
+        self.face_upsampled = 0
+
+    def add(self, trace):
+        stage, timings, details = trace
+        with self.lock:
+            if "face_scale" in details:
+                self.face_scales[details["face_scale"]] = self.face_scales.get(details["face_scale"], 0) + 1
+                self.face_upsampled += details["face_upsampled"]
+            self.resolved[stage] = self.resolved.get(stage, 0) + 1
+            for name, seconds in timings:
+                self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+                self.runs[name] = self.runs.get(name, 0) + 1
+            if stage is not None and stage != "mask":
+                self.early.append(sum(seconds for _, seconds in timings))
+
+    def seconds_saved(self):
+        if not self.runs.get("mask") or not self.early:
+            return None
+        full_mask = self.seconds["mask"] / self.runs["mask"]
+        return sum(max(0.0, full_mask - spent) for spent in self.early)
+
+    def as_dict(self):
+        saved = self.seconds_saved()
+        return {"resolved": {str(stage): count for stage, count in self.resolved.items()},
+                "stage_seconds": {stage: round(seconds, 3) for stage, seconds in self.seconds.items()},
+                "seconds_saved": None if saved is None else round(saved, 3),
+                "face_scales": {str(scale): count for scale, count in sorted(self.face_scales.items())},
+                "face_upsample_retries": self.face_upsampled}
+
+    def summary(self):
+        parts = [f"{stage or 'none'} {count}" for stage, count in self.resolved.items()]
+        if self.face_scales:
+            low, high = min(self.face_scales), max(self.face_scales)
+            scales = f"{low:g}" if low == high else f"{low:g}-{high:g}"
+            parts.append(f"face scale {scales}, {self.face_upsampled} upsampled")
+        saved = self.seconds_saved()
+        if saved is not None:
+            parts.append(f"~{saved:.1f}s saved")
+        return ", ".join(parts)
+
+
+def crop_to_subject(img, box, width_ratio, height_ratio):
+    width, height = img.size
+    top, right, bottom, left = box
+
+    face_width = right - left
+    face_height = bottom - top
+    center_x, center_y = (left + right) // 2, (top + bottom) // 2
+    aspect_ratio = width_ratio / height_ratio
+
+    if face_width / face_height > aspect_ratio:
+        crop_height = min(face_height * 2, height)
+        crop_width = int(crop_height * aspect_ratio)
+    else:
+        crop_width = min(face_width * 2, width)
+        crop_height = int(crop_width / aspect_ratio)
+
+    crop_left = max(0, center_x - crop_width // 2)
+    crop_right = crop_left + crop_width
+    crop_top = max(0, center_y - crop_height // 2)
+    crop_bottom = crop_top + crop_height
+
+    # Adjust if out of bounds
+    if crop_right > width:
+        crop_left = width - crop_width
+    if crop_bottom > height:
+        crop_top = height - crop_height
+    if crop_left < 0:
+        crop_left = 0
+    if crop_top < 0:
+        crop_top = 0
+
+    return img.crop((crop_left, crop_top, crop_right, crop_bottom))
+
+
+def smart_crop(img, width_ratio, height_ratio, get_session, filepath=None, mask_cache=None):
+    return crop_to_subject(img, subject_box(img, get_session, filepath, mask_cache), width_ratio, height_ratio)
+
+
+def fast_crop(img, width, height):
+    img_w, img_h = img.size
+
+    left = (img_w - width) // 2
+    top = (img_h - height) // 2
+    right = left + width
+    bottom = top + height
+
+    # Adjust
+    left = max(0, left)
+    top = max(0, top)
+    right = min(img_w, right)
+    bottom = min(img_h, bottom)
+
+    return img.crop((left, top, right, bottom))
+
+
+def resize_image(img, width, height):
+    return img.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def flatten_to_rgb(img, background_color):
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        # Paste onto background if alpha
+        bg = Image.new('RGB', img.size, tuple(background_color))
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        bg.paste(img, (0, 0), img.split()[3])  # alpha mask
+        return bg
+    return img.convert("RGB")
+
+
+def rotate_image(img, angle):
+    return img.rotate(angle, expand=True)
+
+
+def flip_image(img, flip_type):
+    if flip_type == 'horizontal':
+        return img.transpose(Image.FLIP_LEFT_RIGHT)
+    return img.transpose(Image.FLIP_TOP_BOTTOM)
+
+
+def uses_orientation_tag(filepath, operation, params):
+    """
+    True if this rotate/flip of filepath can be done by rewriting the JPEG's
+    EXIF Orientation tag instead of transforming pixels.
+    """
+    if operation not in ("rotate", "flip") or not params.get("orientation_only") or filepath is None:
+        return False
+    return filepath.lower().endswith(JPEG_EXTENSIONS) and (operation == "flip" or params["angle"] % 90 == 0)
+
+
+# Pillow's exif_transpose method for each EXIF orientation
+ORIENTATION_TRANSPOSES = {
+    1: None,
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def reoriented(orientation, operation, params):
+    """
+    The EXIF orientation that shows the image as it is shown with orientation,
+    then rotated or flipped. Worked out on a tiny probe image rather than a table.
+    """
+    probe = Image.frombytes("L", (3, 2), bytes(range(6)))
+
+    def shown(value):
+        method = ORIENTATION_TRANSPOSES.get(value)
+        return probe if method is None else probe.transpose(method)
+
+    target = apply_operation(shown(orientation), operation, params)
+    for value in ORIENTATION_TRANSPOSES:
+        candidate = shown(value)
+        if candidate.size == target.size and candidate.tobytes() == target.tobytes():
+            return value
+    raise ValueError(f"No EXIF orientation for {operation} {params}")
+
+
+def jpeg_segments(data):
+    """
+    (marker, start, end) of each JPEG header segment before the image data.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker in (0xDA, 0xD9):  # start of scan / end of image
+            break
+        end = pos + 2 + struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        yield marker, pos, end
+        pos = end
+
+
+def set_jpeg_orientation(data, orientation):
+    """
+    The JPEG bytes in data with EXIF Orientation set to orientation. The
+    compressed image data is copied untouched. An existing tag is patched in
+    place; otherwise the EXIF segment is rewritten or a new one added.
+    """
+    exif_segment = None
+    insert_at = 2
+    for marker, start, end in jpeg_segments(data):
+        if marker == 0xE1 and data[start + 4:start + 10] == b"Exif\x00\x00":
+            exif_segment = (start, end)
+            break
+        if marker == 0xE0:  # JFIF must stay first
+            insert_at = end
+
+    if exif_segment is not None:
+        start, end = exif_segment
+        tiff = start + 10
+        order = "<" if data[tiff:tiff + 2] == b"II" else ">"
+        ifd = tiff + struct.unpack(order + "I", data[tiff + 4:tiff + 8])[0]
+        count = struct.unpack(order + "H", data[ifd:ifd + 2])[0]
+        for entry in range(ifd + 2, min(ifd + 2 + 12 * count, end), 12):
+            tag, kind = struct.unpack(order + "HH", data[entry:entry + 4])
+            if tag == EXIF_ORIENTATION and kind == 3:  # SHORT, stored in the entry itself
+                return data[:entry + 8] + struct.pack(order + "H", orientation) + data[entry + 10:]
+        exif = Image.Exif()
+        exif.load(data[start + 4:end])
+    else:
+        start = end = insert_at
+        exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    payload = exif.tobytes()
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError("EXIF data too large to rewrite")
+    return data[:start] + b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload + data[end:]
+
+
+def reorient_jpeg(filepath, output_path, operation, params):
+    """
+    Rotate or flip a JPEG by rewriting its EXIF Orientation tag only.
+    """
+    with open(filepath, "rb") as f:
+        data = f.read()
+    # getexif only parses the header; the pixels are never decoded
+    orientation = Image.open(io.BytesIO(data)).getexif().get(EXIF_ORIENTATION, 1)
+    data = set_jpeg_orientation(data, reoriented(orientation if orientation in ORIENTATION_TRANSPOSES else 1,
+                                                 operation, params))
+    with open(output_path, "wb") as f:
+        f.write(data)
+    return output_path
+
+
+def operation_suffix(operation, params, filepath=None):
+    """
+    Output file suffix for an operation, e.g. resize 800x600 -> "_resized_800x600.png".
+    The extension follows the job's output encoder (convert_jpg is always JPEG,
+    JPEGs rotated via the orientation tag keep their own extension, large
+    images, which are written strip by strip, are always PNG, and animations
+    follow the animation format).
+    """
+    if (operation == "remove_bg" and filepath is not None
+            and params.get("output_mode", OUTPUT_MODE) == "cutout" and is_animated(filepath)):
+        return animation_suffix(params.get("animation_format", ANIMATION_FORMAT))
+    if uses_orientation_tag(filepath, operation, params):
+        ext = os.path.splitext(filepath)[1]
+    elif (operation == "remove_bg" and filepath is not None
+          and is_large_image(filepath, params.get("large_image_mp", LARGE_IMAGE_MP))):
+        ext = ".png"
+    else:
+        ext = encoder_extension(params.get("encoder", OUTPUT_ENCODER))
+    if operation == "remove_bg":
+        return "_nobg" + ext if params.get("output_mode", OUTPUT_MODE) == "cutout" else "_mask.png"
+    if operation == "smart_crop":
+        size = "_{}x{}".format(*params["size"]) if "size" in params else ""
+        return "_crop_{}x{}".format(*params["ratio"]) + size + ext
+    if operation == "fast_crop":
+        return "_fastcrop_{}x{}".format(*params["size"]) + ext
+    if operation == "resize":
+        return "_resized_{}x{}".format(*params["size"]) + ext
+    if operation == "convert_jpg":
+        return "_converted.jpg"
+    if operation == "rotate":
+        return f"_rotated_{params['angle']}" + ext
+    if operation == "flip":
+        return ("_flippedH" if params["flip_type"] == 'horizontal' else "_flippedV") + ext
+    if operation == "chain":
+        # Each step's suffix in turn, keeping only the last step's extension
+        suffixes = [operation_suffix(step, step_params) for step, step_params in params["steps"]]
+        return "".join(os.path.splitext(suffix)[0] for suffix in suffixes[:-1]) + suffixes[-1]
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def run_operation_file(filepath, save_path, operation, params, get_session=None, mask_cache=None):
+    """
+    Apply one operation to filepath and save the result. Returns the output path.
+    Batch jobs should prefer run_operation_batch for remove_bg, which batches inference.
+    """
+    if operation == "remove_bg":
+        results = remove_background_batch([filepath], save_path, get_session(), mask_cache,
+                                          params["large_image_mp"], params["refine"],
+                                          params.get("animation_format", ANIMATION_FORMAT),
+                                          params.get("encoder", OUTPUT_ENCODER), params.get("output_mode", OUTPUT_MODE))
+        _, output_path, error = results[0]
+        if error is not None:
+            raise error
+        return output_path
+    if operation == "smart_crop":
+        return smart_crop_file(filepath, save_path, [params], get_session, mask_cache)[0]
+    if operation == "chain":
+        return run_chain_file(filepath, save_path, params["steps"], get_session, mask_cache)
+    if uses_orientation_tag(filepath, operation, params):
+        output_path = os.path.join(save_path, output_name(filepath, operation_suffix(operation, params, filepath)))
+        return reorient_jpeg(filepath, output_path, operation, params)
+    img = Image.open(filepath)
+    if operation in ("rotate", "flip"):
+        # Rotate/flip what the viewer sees, not the stored pixels of an EXIF-rotated photo
+        img = ImageOps.exif_transpose(img)
+    img = apply_operation(img, operation, params)
+    return save_operation_output(img, filepath, save_path, operation, params)
+
+
+def apply_operation(img, operation, params, get_session=None, filepath=None, mask_cache=None):
+    """
+    One operation on an image in memory. filepath (and with it the mask cache
+    and the JPEG re-decode for face detection) may only be given while img is
+    still the unmodified, upright decode of that file.
+    """
+    if operation == "remove_bg":
+        img = img.convert("RGBA")
+        if filepath is not None:
+            mask = cached_predict_masks(get_session(), [filepath], [img], mask_cache)[0]
+        else:
+            mask = predict_masks(get_session(), [img])[0]
+        return cutout(img, refine_mask(img, mask, params["refine"]))
+    if operation == "smart_crop":
+        img = img.convert("RGBA")
+        crop = crop_to_subject(img, subject_box(img, get_session, filepath, mask_cache), *params["ratio"])
+        return resize_image(crop, *params["size"]) if "size" in params else crop
+    if operation == "fast_crop":
+        return fast_crop(img, *params["size"])
+    if operation == "resize":
+        return resize_image(img, *params["size"])
+    if operation == "convert_jpg":
+        return flatten_to_rgb(img, params["background"])
+    if operation == "rotate":
+        return rotate_image(img, params["angle"])
+    if operation == "flip":
+        return flip_image(img, params["flip_type"])
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def save_operation_output(img, filepath, save_path, operation, params):
+    output_path = os.path.join(save_path, output_name(filepath, operation_suffix(operation, params)))
+    return write_output(img, output_path, operation, params)
+
+
+def write_output(img, output_path, operation, params):
+    if operation == "convert_jpg":
+        img.save(output_path, format="JPEG", quality=95)
+    else:
+        encode_image(img, output_path, params.get("encoder", OUTPUT_ENCODER))
+    return output_path
+
+
+def crop_variants(ratios=(), sizes=(), model=DEFAULT_MODEL, encoder=OUTPUT_ENCODER):
+    """
+    Smart Crop params for several outputs of one image: each ratio, plus each
+    pixel size (cropped to its own reduced ratio, then resized), e.g.
+    sizes [(800, 1200)] -> ratio 2:3 resized to 800x1200.
+    """
+    variants = [{"ratio": list(ratio), "model": model, "encoder": encoder} for ratio in ratios]
+    for width, height in sizes:
+        divisor = math.gcd(width, height)
+        variants.append({"ratio": [width // divisor, height // divisor], "size": [width, height],
+                         "model": model, "encoder": encoder})
+    return variants
+
+
+def parse_crop_spec(spec):
+    """
+    "1:1, 4:6, 800x1200" -> ([(1, 1), (4, 6)], [(800, 1200)]). Raises ValueError.
+    """
+    ratios, sizes = [], []
+    for token in re.split(r"[,\s]+", spec.strip()):
+        match = re.fullmatch(r"(\d+)([:x])(\d+)", token)
+        if not match or int(match.group(1)) <= 0 or int(match.group(3)) <= 0:
+            raise ValueError(f"Invalid crop {token!r}! Use ratios like 4:3 or sizes like 800x600")
+        (ratios if match.group(2) == ":" else sizes).append((int(match.group(1)), int(match.group(3))))
+    return ratios, sizes
+
+
+# Threads save_crops encodes variants on; pool workers lower it to their share of the cores
+_crop_encode_threads = PHYSICAL_CORES
+
+
+def save_crops(img, box, filepath, save_path, variants):
+    """
+    Write one crop of img around box per Smart Crop params dict. Returns the output paths.
+    """
+    def save(params):
+        crop = crop_to_subject(img, box, *params["ratio"])
+        if "size" in params:
+            crop = resize_image(crop, *params["size"])
+        return save_operation_output(crop, filepath, save_path, "smart_crop", params)
+
+    threads = min(len(variants), _crop_encode_threads)
+    if threads == 1:
+        return [save(params) for params in variants]
+    # Encoding dominates for large crops; Pillow's encoders release the GIL
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(save, variants))
+
+
+def smart_crop_file(filepath, save_path, variants, get_session, mask_cache=None, stats=None):
+    """
+    Decode filepath and find its subject once, then write every variant.
+    """
+    img = load_image(filepath)
+    box = subject_box(img, get_session, filepath, mask_cache, stats)
+    return save_crops(img, box, filepath, save_path, variants)
+
+
+def split_localizer_stages(stages=LOCALIZER_STAGES):
+    """
+    (leading stages that need no session, the rest) - the process pools run the
+    first part on the CPU pool and only hand unresolved files to the model pool.
+    """
+    index = next((i for i, stage in enumerate(stages) if stage in LOCALIZER_MODEL_STAGES), len(stages))
+    return stages[:index], stages[index:]
+
+
+def smart_crop_cpu_file(filepath, save_path, variants):
+    """
+    Smart Crop's session-free localizer stages on their own. Returns
+    (output paths, or None when a model stage is still needed, trace).
+    """
+    img = load_image(filepath)
+    box, trace = localize_subject(img, None, filepath, None, split_localizer_stages()[0])
+    if box is None:
+        return None, trace
+    return save_crops(img, box, filepath, save_path, variants), trace
+
+
+def smart_crop_model_file(filepath, save_path, variants, get_session, mask_cache=None):
+    """
+    The remaining (model) localizer stages, for files smart_crop_cpu_file could
+    not resolve. Returns (output paths, trace).
+    """
+    img = load_image(filepath)
+    box, trace = localize_subject(img, get_session, filepath, mask_cache, split_localizer_stages()[1])
+    if box is None:
+        raise ValueError("No subject detected!")
+    return save_crops(img, box, filepath, save_path, variants), trace
+
+
+def run_smart_crop_batch(filepaths, save_path, variants, workers=1, ort_settings=None, cache_mb=MASK_CACHE_MB,
+                         should_stop=lambda: False, stats=None):
+    """
+    Smart Crop without any GUI, writing every variant of each file from one
+    decode and one subject search. Yields (filepath, output_paths, error) in
+    input order, through run_smart_crop_pools (FACE_WORKERS unless workers > 1)
+    when there are several files. stats is an optional LocalizerStats.
+    """
+    face_workers = workers if workers > 1 else FACE_WORKERS
+    if face_workers > 1 and len(filepaths) > 1:
+        yield from run_smart_crop_pools(filepaths, save_path, variants, face_workers, SMART_CROP_MASK_WORKERS,
+                                        ort_settings, cache_mb, should_stop, stats)
+        return
+    mask_cache = create_mask_cache(MASK_CACHE_DIR, cache_mb)
+    sessions = SessionPool(ort_settings if ort_settings is not None else load_ort_settings())
+    model_name = variants[0]["model"]
+    for filepath in filepaths:
+        if should_stop():
+            return
+        try:
+            yield filepath, smart_crop_file(filepath, save_path, variants,
+                                            lambda model=None: sessions.get(model or model_name),
+                                            mask_cache, stats), None
+        except Exception as e:
+            yield filepath, None, e
+
+
+def split_core_budget(face_workers, mask_workers, cores=PHYSICAL_CORES):
+    """
+    (face processes, cores for the mask sessions) for Smart Crop's two pools,
+    which run at the same time. The mask sessions get at least half of the
+    cores (and one per mask worker), the single-threaded face processes the
+    rest, and cores the face pool does not use go back to the mask sessions.
+    """
+    mask_cores = max(1, min(cores, max(mask_workers, cores // 2)))
+    face_workers = max(1, min(face_workers, cores - mask_cores))
+    return face_workers, max(mask_cores, cores - face_workers)
+
+
+def run_smart_crop_pools(filepaths, save_path, variants, face_workers=FACE_WORKERS,
+                         mask_workers=SMART_CROP_MASK_WORKERS, ort_settings=None, cache_mb=MASK_CACHE_MB,
+                         should_stop=lambda: False, stats=None):
+    """
+    Smart Crop over two process pools: every file runs the session-free
+    localizer stages (faces, saliency) on the CPU pool, and a file they cannot
+    resolve is handed on to the model pool as soon as they finish, so cheap
+    files never queue behind mask inference. Yields (filepath, output_paths,
+    error) in input order, one output per params dict in variants. stats is an
+    optional LocalizerStats. The physical cores are split between the pools
+    with split_core_budget.
+    """
+    ort_settings = ort_settings if ort_settings is not None else load_ort_settings()
+    face_workers, mask_cores = split_core_budget(face_workers, mask_workers)
+    spawn = multiprocessing.get_context("spawn")
+    # split_core_budget gives each face process one core
+    face_pool = ProcessPoolExecutor(max_workers=face_workers, mp_context=spawn, initializer=_init_face_worker)
+    # Model workers (and their sessions) only start once a file needs them
+    mask_pool = ProcessPoolExecutor(max_workers=mask_workers, mp_context=spawn, initializer=_init_operation_worker,
+                                    initargs=(ort_settings, MASK_CACHE_DIR, cache_mb, mask_workers, mask_cores))
+    slots = [Future() for _ in filepaths]
+
+    def record(trace):
+        if stats is not None and trace is not None:
+            stats.add(trace)
+
+    def finish(slot, filepath, cpu_trace, future):
+        try:
+            _, output_paths, error, trace = future.result()
+        except Exception as e:
+            output_paths, error, trace = None, e, None
+        if trace is not None:
+            trace = (trace[0], cpu_trace[1] + trace[1], {**cpu_trace[2], **trace[2]})
+        record(trace)
+        slot.set_result((filepath, output_paths, error))
+
+    def face_done(slot, filepath, future):
+        try:
+            _, output_paths, error, trace = future.result()
+        except Exception as e:
+            output_paths, error, trace = None, e, None
+        if output_paths is not None or error is not None:
+            record(trace)
+            slot.set_result((filepath, output_paths, error))
+            return
+        try:
+            mask_future = mask_pool.submit(_mask_crop_worker, filepath, save_path, variants)
+        except RuntimeError as e:  # the pools are shutting down
+            slot.set_result((filepath, None, e))
+            return
+        mask_future.add_done_callback(lambda f: finish(slot, filepath, trace, f))
+
+    try:
+        for slot, filepath in zip(slots, filepaths):
+            face_pool.submit(_face_crop_worker, filepath, save_path, variants).add_done_callback(
+                lambda f, slot=slot, filepath=filepath: face_done(slot, filepath, f))
+        for slot in slots:
+            while not wait([slot], timeout=0.25).done:
+                if should_stop():
+                    return
+            if should_stop():
+                return
+            yield slot.result()
+    finally:
+        face_pool.shutdown(wait=False, cancel_futures=True)
+        mask_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def chain_output_path(filepath, save_path, steps):
+    """
+    Final output of a chain, e.g. remove_bg then smart_crop 1:1 -> <name>_nobg_crop_1x1.png.
+    """
+    return os.path.join(save_path, output_name(filepath, operation_suffix("chain", {"steps": steps})))
+
+
+def run_chain_file(filepath, save_path, steps, get_session, mask_cache=None):
+    """
+    Feed filepath through steps [(operation, params), ...] in memory: one
+    decode, each step working on the previous step's image, one encode with
+    the last step's encoder. get_session(model_name) returns a warm session.
+    Returns the output path. Animations and large images starting with
+    remove_bg keep their streamed paths, so they go through files instead.
+    """
+    operation, params = steps[0]
+    if operation == "remove_bg" and (is_animated(filepath) or is_large_image(filepath, params["large_image_mp"])):
+        return run_chain_on_files(filepath, save_path, steps, get_session, mask_cache)
+
+    img = ImageOps.exif_transpose(Image.open(filepath))
+    source = filepath
+    for operation, params in steps:
+        model_name = params.get("model", DEFAULT_MODEL)
+        img = apply_operation(img, operation, params, lambda model=None: get_session(model or model_name),
+                              source, mask_cache if source else None)
+        source = None  # later steps see a modified image
+    return write_output(img, chain_output_path(filepath, save_path, steps), operation, params)
+
+
+def run_chain_on_files(filepath, save_path, steps, get_session, mask_cache=None):
+    """
+    run_chain_file through intermediate files in a temporary folder; only the
+    last step writes to save_path.
+    """
+    with tempfile.TemporaryDirectory(prefix="smart_remove_bg_") as work_dir:
+        current = filepath
+        for index, (operation, params) in enumerate(steps):
+            target = save_path if index == len(steps) - 1 else work_dir
+            model_name = params.get("model", DEFAULT_MODEL)
+            current = run_operation_file(current, target, operation, params,
+                                         lambda model=None: get_session(model or model_name), mask_cache)
+    return current
+
+
+def chain_steps(chain, model=DEFAULT_MODEL, refine=EDGE_REFINE, large_image_mp=LARGE_IMAGE_MP,
+                animation_format=ANIMATION_FORMAT, encoder=OUTPUT_ENCODER):
+    """
+    Fill the model and output options into parsed chain steps, giving the
+    steps run_chain_file and the manifest expect.
+    """
+    steps = []
+    for index, (operation, params) in enumerate(chain):
+        if operation == "remove_bg":
+            # Later steps need the cutout, never a mask-only output
+            params = {"model": model, "refine": refine, "large_image_mp": large_image_mp,
+                      "animation_format": animation_format, "output_mode": "cutout"}
+        elif operation == "smart_crop":
+            params = {**params, "model": model}
+        if operation != "convert_jpg":
+            # Only used when a chain falls back to intermediate files, which are read straight back
+            params = {**params, "encoder": encoder if index == len(chain) - 1 else "png-fast"}
+        steps.append((operation, params))
+    return steps
+
+
+def chain_spec(steps):
+    """
+    The inverse of parse_chain: [(operation, params), ...] -> "remove-bg,smart-crop=1:1".
+    """
+    tokens = []
+    for operation, params in steps:
+        if operation == "remove_bg":
+            tokens.append("remove-bg")
+        elif operation == "smart_crop":
+            tokens.append("smart-crop={}:{}".format(*params["ratio"]))
+        elif operation in ("fast_crop", "resize"):
+            tokens.append("{}={}x{}".format(operation.replace("_", "-"), *params["size"]))
+        elif operation == "convert_jpg":
+            tokens.append("to-jpg=#{:02X}{:02X}{:02X}".format(*params["background"]))
+        elif operation == "rotate":
+            tokens.append(f"rotate={params['angle']}")
+        elif operation == "flip":
+            tokens.append(f"flip={params['flip_type']}")
+        else:
+            raise ValueError(f"Unknown operation: {operation}")
+    return ",".join(tokens)
+
+
+def recipe_path(name):
+    return name if name.lower().endswith(".json") else os.path.join(RECIPES_DIR, name + ".json")
+
+
+def save_recipe(name, spec):
+    os.makedirs(RECIPES_DIR, exist_ok=True)
+    with open(recipe_path(name), "w", encoding="utf-8") as f:
+        json.dump({"name": name, "chain": spec}, f, indent=2)
+
+
+def load_recipe(name):
+    """
+    The chain spec of a saved recipe, by name or by the path of its .json file.
+    """
+    with open(recipe_path(name), encoding="utf-8") as f:
+        return json.load(f)["chain"]
+
+
+def list_recipes():
+    if not os.path.isdir(RECIPES_DIR):
+        return []
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(RECIPES_DIR) if name.endswith(".json"))
+
+
+def run_operation_batch(operation, filepaths, save_path, params, workers=1, batch_size=BATCH_SIZE,
+                        ort_settings=None, cache_mb=MASK_CACHE_MB, should_stop=lambda: False):
+    """
+    Run one operation over many files without any GUI, yielding
+    (filepath, output_path, error) as each file finishes. With workers > 1 the
+    files are spread over a process pool whose workers keep their own sessions.
+    Chains use CHAIN_WORKERS unless workers > 1. Smart Crop goes through
+    run_smart_crop_batch.
+    """
+    ort_settings = ort_settings if ort_settings is not None else load_ort_settings()
+    if operation == "chain" and workers <= 1:
+        workers = CHAIN_WORKERS
+    model_name = params.get("model", DEFAULT_MODEL)
+    parallel = workers > 1 and len(filepaths) > 1
+
+    if operation == "smart_crop":
+        for filepath, output_paths, error in run_smart_crop_batch(filepaths, save_path, [params], workers,
+                                                                  ort_settings, cache_mb, should_stop):
+            yield filepath, output_paths[0] if output_paths else None, error
+        return
+    if parallel:
+        if operation == "remove_bg":
+            initializer, initargs = _init_remove_worker, (model_name, ort_settings, workers, MASK_CACHE_DIR, cache_mb)
+        else:
+            initializer, initargs = _init_operation_worker, (ort_settings, MASK_CACHE_DIR, cache_mb, workers)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=initializer, initargs=initargs) as pool:
+            if operation == "remove_bg":
+                futures = [pool.submit(_remove_worker, batch, save_path, params["large_image_mp"], params["refine"],
+                                       params.get("animation_format", ANIMATION_FORMAT),
+                                       params.get("encoder", OUTPUT_ENCODER), params.get("output_mode", OUTPUT_MODE))
+                           for batch in chunked(filepaths, batch_size)]
+            else:
+                futures = [pool.submit(_operation_worker, filepath, save_path, operation, params)
+                           for filepath in filepaths]
+            # Results stream back in completion order
+            for future in as_completed(futures):
+                if should_stop():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                if operation == "remove_bg":
+                    yield from future.result()[0]
+                else:
+                    yield future.result()
+        return
+
+    mask_cache = create_mask_cache(MASK_CACHE_DIR, cache_mb)
+    sessions = SessionPool(ort_settings)
+    if operation == "remove_bg":
+        pipeline = Pipeline(should_stop)
+        yield from pipeline.run(filepaths, save_path, sessions.get(model_name), mask_cache,
+                                params["large_image_mp"], params["refine"], batch_size,
+                                params.get("animation_format", ANIMATION_FORMAT),
+                                params.get("encoder", OUTPUT_ENCODER), params.get("output_mode", OUTPUT_MODE))
+        return
+    for filepath in filepaths:
+        if should_stop():
+            return
+        try:
+            output_path = run_operation_file(filepath, save_path, operation, params,
+                                             lambda model=None: sessions.get(model or model_name), mask_cache)
+            yield filepath, output_path, None
+        except Exception as e:
+            yield filepath, None, e
+
+
+# ---------------------------------------------------------------------
+#        Process-pool workers (each process keeps its own session)
+# ---------------------------------------------------------------------
+_worker_session = None
+_worker_mask_cache = None
+
+
+def _init_remove_worker(model_name, ort_settings, workers, cache_dir, cache_mb):
+    global _worker_session, _worker_mask_cache
+    _worker_session = create_session(model_name, ort_settings, workers)
+    _worker_mask_cache = create_mask_cache(cache_dir, cache_mb)
+
+
+def _init_operation_worker(ort_settings, cache_dir, cache_mb, workers=1, cores=PHYSICAL_CORES):
+    global _worker_session, _worker_mask_cache, _crop_encode_threads
+    # Sessions are only loaded if a Smart Crop finds no face
+    _worker_session = SessionPool(ort_settings, workers, cores)
+    _worker_mask_cache = create_mask_cache(cache_dir, cache_mb)
+    _crop_encode_threads = max(1, cores // workers)
+
+
+def _init_face_worker(threads=1):
+    global _crop_encode_threads
+    _crop_encode_threads = threads
+
+
+def _operation_worker(filepath, save_path, operation, params):
+    model_name = params.get("model", DEFAULT_MODEL)
+    try:
+        output_path = run_operation_file(filepath, save_path, operation, params,
+                                         lambda model=None: _worker_session.get(model or model_name),
+                                         _worker_mask_cache)
+        return filepath, output_path, None
+    except Exception as e:
+        return filepath, None, e
+
+
+def _face_crop_worker(filepath, save_path, variants):
+    try:
+        output_paths, trace = smart_crop_cpu_file(filepath, save_path, variants)
+        return filepath, output_paths, None, trace
+    except Exception as e:
+        return filepath, None, e, None
+
+
+def _mask_crop_worker(filepath, save_path, variants):
+    model_name = variants[0].get("model", DEFAULT_MODEL)
+    try:
+        output_paths, trace = smart_crop_model_file(filepath, save_path, variants,
+                                                    lambda model=None: _worker_session.get(model or model_name),
+                                                    _worker_mask_cache)
+        return filepath, output_paths, None, trace
+    except Exception as e:
+        return filepath, None, e, None
+
+
+def _remove_worker(filepaths, save_path, large_image_mp, refine, animation_format=ANIMATION_FORMAT,
+                   encoder=OUTPUT_ENCODER, output_mode=OUTPUT_MODE):
+    """
+    Returns (results, mask cache hits, mask cache misses) for this batch.
+    """
+    cache = _worker_mask_cache
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+    results = remove_background_batch(filepaths, save_path, _worker_session, cache, large_image_mp, refine,
+                                      animation_format, encoder, output_mode)
+    if cache is None:
+        return results, 0, 0
+    return results, cache.hits - hits, cache.misses - misses
+
+
 class ImageProcessorApp:
     def __init__(self, root):
         self.root = root
@@ -47,6 +2705,27 @@ class ImageProcessorApp:
         self.processing_thread = None
         self.stop_processing = False
 
+        # Warm rembg sessions shared by every background-removal call
+        self.ort_settings = load_ort_settings()
+        self.session_pool = SessionPool(self.ort_settings)
+        self.model_name = DEFAULT_MODEL
+        self.mask_cache = create_mask_cache()
+        self.large_image_mode = tk.BooleanVar(value=LARGE_IMAGE_MP > 0)
+        self.refine_var = tk.StringVar(value=EDGE_REFINE)
+        self.animation_format_var = tk.StringVar(value=ANIMATION_FORMAT)
+        self.encoder_var = tk.StringVar(value=OUTPUT_ENCODER)
+        self.output_mode_var = tk.StringVar(value=OUTPUT_MODE)
+        self.stage_utilization = ""
+        self.incremental_var = tk.BooleanVar(value=os.getenv('SKIP_UP_TO_DATE', '1') != '0')
+        self.orientation_only_var = tk.BooleanVar(value=ORIENTATION_ONLY)
+        self.skipped_count = 0
+
+        # Optional process pool for Process Images (kept warm between batches)
+        self.worker_count = PROCESS_WORKERS
+        self.batch_size = BATCH_SIZE
+        self.process_pool = None
+        self.process_pool_key = None
+
         # License storage file
         self.license_file = "license.json"
 
@@ -87,17 +2766,7 @@ class ImageProcessorApp:
             }
         Otherwise returns False.
         """
-        if not os.path.exists(self.license_file):
-            return False
-        try:
-            with open(self.license_file, "r") as f:
-                data = json.load(f)
-            if (data.get("status") == "success" and
-                data.get("message") == "License validated successfully"):
-                return True
-        except Exception:
-            pass
-        return False
+        return local_license_valid(self.license_file)
 
     def load_local_license_data(self):
         """
@@ -264,6 +2933,7 @@ class ImageProcessorApp:
         # View Menu
         view_menu = tk.Menu(menubar, tearoff=0)
         view_menu.add_command(label="Processed Files", command=self.show_processed_files)
+        view_menu.add_command(label="Session Stats", command=self.show_session_stats)
         menubar.add_cascade(label="View", menu=view_menu)
 
         # Tools Menu (Smart Crop)
@@ -274,7 +2944,25 @@ class ImageProcessorApp:
         smart_crop_menu.add_command(label="16:9 (Widescreen)", command=lambda: self.smart_crop_images(16, 9))
         smart_crop_menu.add_command(label="3:2 (Photo)", command=lambda: self.smart_crop_images(3, 2))
         smart_crop_menu.add_command(label="Custom Ratio", command=self.smart_crop_custom)
+        smart_crop_menu.add_separator()
+        smart_crop_menu.add_command(
+            label="All Four Ratios (one pass)",
+            command=lambda: self.smart_crop_multi(crop_variants(CATALOG_CROP_RATIOS, (), self.model_name,
+                                                                self.encoder_var.get()))
+        )
+        smart_crop_menu.add_command(label="Multiple Ratios / Sizes...", command=self.smart_crop_multi)
         tools_menu.add_cascade(label="Smart Crop", menu=smart_crop_menu)
+        composite_menu = tk.Menu(tools_menu, tearoff=0)
+        composite_menu.add_command(label="Transparent PNG", command=lambda: self.composite_masks("rgba"))
+        composite_menu.add_command(label="Cropped Cutout", command=lambda: self.composite_masks("cutout"))
+        composite_menu.add_command(label="JPG on Colour...", command=lambda: self.composite_masks("jpg"))
+        tools_menu.add_cascade(label="Composite Masks", menu=composite_menu)
+        recipes_menu = tk.Menu(tools_menu, tearoff=0)
+        recipes_menu.add_command(label="New Recipe...", command=self.show_recipe_builder)
+        run_recipe_menu = tk.Menu(recipes_menu, tearoff=0)
+        run_recipe_menu.configure(postcommand=lambda: self.fill_recipe_menu(run_recipe_menu))
+        recipes_menu.add_cascade(label="Run Recipe", menu=run_recipe_menu)
+        tools_menu.add_cascade(label="Recipes", menu=recipes_menu)
         menubar.add_cascade(label="Tools", menu=tools_menu)
 
         # Quick Tools Menu
@@ -299,6 +2987,57 @@ class ImageProcessorApp:
 
         menubar.add_cascade(label="Quick Tools", menu=quick_tools_menu)
 
+        # Settings Menu
+        settings_menu = tk.Menu(menubar, tearoff=0)
+        self.model_var = tk.StringVar(value=self.model_name)
+        model_menu = tk.Menu(settings_menu, tearoff=0)
+        for model_name, label in MODEL_TIERS:
+            model_menu.add_radiobutton(label=label, value=model_name, variable=self.model_var,
+                                       command=self.select_model)
+        model_menu.add_separator()
+        for model_name, label in MODEL_TIERS:
+            model_menu.add_radiobutton(label=f"{label} [INT8]", value=model_name + INT8_SUFFIX,
+                                       variable=self.model_var, command=self.select_model)
+        settings_menu.add_cascade(label="Model", menu=model_menu)
+        settings_menu.add_command(label="Quantize Installed Models (INT8)", command=self.quantize_models)
+        settings_menu.add_command(label="Worker Processes", command=self.set_worker_count)
+        settings_menu.add_command(label="Batch Size", command=self.set_batch_size)
+        settings_menu.add_command(label="ONNX Runtime", command=self.show_ort_settings)
+        settings_menu.add_command(label="Clear Mask Cache", command=self.clear_mask_cache)
+        settings_menu.add_checkbutton(label="Skip Up-to-Date Outputs", variable=self.incremental_var)
+        settings_menu.add_checkbutton(label="Rotate/Flip JPEGs via EXIF Orientation",
+                                      variable=self.orientation_only_var)
+        refine_menu = tk.Menu(settings_menu, tearoff=0)
+        for level in REFINE_LEVELS:
+            refine_menu.add_radiobutton(label=level.capitalize(), value=level, variable=self.refine_var)
+        settings_menu.add_cascade(label="Edge Refinement", menu=refine_menu)
+        animation_menu = tk.Menu(settings_menu, tearoff=0)
+        for label, value in (("Animated PNG", "apng"), ("Animated WebP", "webp"), ("PNG Sequence", "png-sequence")):
+            animation_menu.add_radiobutton(label=label, value=value, variable=self.animation_format_var)
+        settings_menu.add_cascade(label="Animation Output", menu=animation_menu)
+        encoder_menu = tk.Menu(settings_menu, tearoff=0)
+        for encoder, spec in OUTPUT_ENCODERS.items():
+            encoder_menu.add_radiobutton(label=spec["label"], value=encoder, variable=self.encoder_var)
+        settings_menu.add_cascade(label="Output Encoder", menu=encoder_menu)
+        output_menu = tk.Menu(settings_menu, tearoff=0)
+        for mode, label in OUTPUT_MODES.items():
+            output_menu.add_radiobutton(label=label, value=mode, variable=self.output_mode_var)
+        settings_menu.add_cascade(label="Process Images Output", menu=output_menu)
+        settings_menu.add_checkbutton(
+            label=f"Large Image Mode (over {LARGE_IMAGE_MP or 24:g} MP)", variable=self.large_image_mode
+        )
+        menubar.add_cascade(label="Settings", menu=settings_menu)
+
+        # Benchmark Menu
+        benchmark_menu = tk.Menu(menubar, tearoff=0)
+        benchmark_menu.add_command(label="Batch Sizes (1/4/8/16)", command=self.benchmark_batch_sizes)
+        benchmark_menu.add_command(label="Model Tiers", command=self.benchmark_models)
+        benchmark_menu.add_command(label="INT8 vs FP32", command=self.benchmark_int8)
+        benchmark_menu.add_command(label="Edge Refinement vs Alpha Matting", command=self.benchmark_refinement)
+        benchmark_menu.add_command(label="Output Encoders", command=self.benchmark_encoders)
+        benchmark_menu.add_command(label="Reduced JPEG Decode", command=self.benchmark_decode)
+        menubar.add_cascade(label="Benchmark", menu=benchmark_menu)
+
     def show_about(self):
         messagebox.showinfo("About", "Smart Remove BG & Crop Image: v1.0\nDeveloper: novhuninfo@gmail.com")
 
@@ -312,6 +3051,130 @@ class ImageProcessorApp:
     def show_terms(self):
         messagebox.showinfo("Terms & Privacy", "No data stored or shared. Use at your own risk.")
 
+    def show_session_stats(self):
+        stats = self.session_pool.stats_text()
+        if self.mask_cache:
+            stats += "\n" + self.mask_cache.stats_text()
+        if self.stage_utilization:
+            stats += "\nLast run stage utilization: " + self.stage_utilization
+        messagebox.showinfo("Session Stats", stats)
+
+    def large_image_mp(self):
+        # Megapixel threshold for large-image mode, 0 when it is switched off
+        return (LARGE_IMAGE_MP or 24) if self.large_image_mode.get() else 0
+
+    def cache_status(self):
+        return f" | {self.mask_cache.stats_text()}" if self.mask_cache else ""
+
+    def clear_mask_cache(self):
+        if not self.mask_cache:
+            messagebox.showinfo("Mask Cache", "The mask cache is disabled (MASK_CACHE_MB=0).")
+            return
+        self.mask_cache.clear()
+        self.status_label.config(text="Mask cache cleared")
+
+    def select_model(self):
+        # Applies to jobs started from now on (Process Images and Smart Crop)
+        self.model_name = self.model_var.get()
+        if model_installed(self.model_name):
+            self.status_label.config(text=f"Model set to {self.model_name}")
+        else:
+            self.status_label.config(text=f"Model set to {self.model_name} (downloads on first use)")
+
+    def quantize_models(self):
+        models = [model_name for model_name, _ in MODEL_TIERS if model_installed(model_name)]
+        if not models:
+            messagebox.showerror("Error", "No rembg models are installed yet.")
+            return
+        threading.Thread(target=self._quantize_models_thread, args=(models,), daemon=True).start()
+
+    def _quantize_models_thread(self, models):
+        for model_name in models:
+            self.status_label.config(text=f"Quantizing {model_name} to INT8...")
+            try:
+                ensure_quantized_model(model_name)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to quantize {model_name}: {str(e)}")
+                return
+        self.status_label.config(text="Quantization Completed!")
+        messagebox.showinfo("Quantize Done", f"INT8 models ready for: {', '.join(models)}")
+
+    def set_worker_count(self):
+        count = simpledialog.askinteger(
+            "Worker Processes",
+            f"Number of worker processes for Process Images\n"
+            f"(1 = single thread, this machine has {PHYSICAL_CORES} physical cores):",
+            initialvalue=self.worker_count, minvalue=1, maxvalue=os.cpu_count() or PHYSICAL_CORES
+        )
+        if count:
+            self.worker_count = count
+            self.status_label.config(text=f"Worker processes set to {count}")
+
+    def show_ort_settings(self):
+        settings_window = tk.Toplevel(self.root)
+        settings_window.title("ONNX Runtime Settings")
+        settings_window.geometry("460x300")
+        settings_window.columnconfigure(1, weight=1)
+
+        choices = {
+            "intra_op_threads": ["auto"] + [str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+            "inter_op_threads": ["auto"] + [str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+            "graph_optimization": list(GRAPH_OPTIMIZATION_LEVELS),
+            "execution_mode": list(EXECUTION_MODES),
+            "providers": ["auto"] + ort.get_available_providers(),
+        }
+        labels = {
+            "intra_op_threads": "Intra-op threads",
+            "inter_op_threads": "Inter-op threads",
+            "graph_optimization": "Graph optimization",
+            "execution_mode": "Execution mode",
+            "providers": "Execution providers",
+        }
+        variables = {}
+        for row, (key, values) in enumerate(choices.items()):
+            ttk.Label(settings_window, text=labels[key]).grid(row=row, column=0, sticky='w', padx=10, pady=5)
+            variables[key] = tk.StringVar(value=self.ort_settings[key])
+            ttk.Combobox(settings_window, textvariable=variables[key], values=values).grid(
+                row=row, column=1, sticky='ew', padx=10, pady=5
+            )
+
+        ttk.Label(
+            settings_window,
+            text=f"\"auto\" splits {PHYSICAL_CORES} physical cores between the worker processes.\n"
+                 f"Environment variables ({', '.join(ORT_ENV_VARS.values())}) override this file.",
+            wraplength=420
+        ).grid(row=len(choices), column=0, columnspan=2, padx=10, pady=5)
+
+        def save():
+            settings = {key: var.get().strip() for key, var in variables.items()}
+            try:
+                build_session_options(settings)
+            except (KeyError, ValueError) as e:
+                messagebox.showerror("Error", f"Invalid setting: {str(e)}")
+                return
+            try:
+                save_ort_settings(settings)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
+                return
+            self.ort_settings = settings
+            self.session_pool.configure(settings)
+            self.status_label.config(text="ONNX Runtime settings saved")
+            settings_window.destroy()
+
+        ttk.Button(settings_window, text="Save", command=save, style="Cool.TButton").grid(
+            row=len(choices) + 1, column=0, columnspan=2, pady=10
+        )
+
+    def set_batch_size(self):
+        size = simpledialog.askinteger(
+            "Batch Size", "Images per inference call:",
+            initialvalue=self.batch_size, minvalue=1, maxvalue=64
+        )
+        if size:
+            self.batch_size = size
+            self.status_label.config(text=f"Batch size set to {size}")
+
     def create_gui(self):
         style = ttk.Style()
         style.theme_use("clam")
@@ -427,7 +3290,7 @@ class ImageProcessorApp:
 
     def import_images(self):
         files = filedialog.askopenfilenames(
-            filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp")]
+            filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.webp")]
         )
         new_files = [f for f in files if f not in self.image_files]
         self.image_files.extend(new_files)
@@ -442,9 +3305,7 @@ class ImageProcessorApp:
         frame.pack(fill='x', pady=2)
         frame.columnconfigure(1, weight=1)
         try:
-            img = Image.open(filepath)
-            img.thumbnail((50, 50))
-            thumbnail = ImageTk.PhotoImage(img)
+            thumbnail = ImageTk.PhotoImage(open_reduced(filepath, THUMBNAIL_SIDE))
             self.thumbnails.append(thumbnail)
             ttk.Label(frame, image=thumbnail).grid(row=0, column=0, padx=5)
         except Exception:
@@ -471,9 +3332,7 @@ class ImageProcessorApp:
             self.preview_canvas.configure(scrollregion=(0, 0, 0, 0))
             return
         try:
-            img = Image.open(self.preview_filepath)
-            max_size = 400
-            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            img = open_reduced(self.preview_filepath, PREVIEW_SIDE)
             base_dim = max(img.size)
             new_size = int(base_dim * self.preview_zoom_factor)
             w, h = img.size
@@ -522,7 +3381,7 @@ class ImageProcessorApp:
             self.clear_preview()
 
     def change_image(self, filepath):
-        new_image = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp")])
+        new_image = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.webp")])
         if new_image and new_image != filepath:
             idx = self.image_files.index(filepath)
             self.image_files[idx] = new_image
@@ -559,42 +3418,338 @@ class ImageProcessorApp:
         else:
             self.status_label.config(text="Folder selection cancelled.")
 
+    def _start_job(self, operation, params, variants=None):
+        """
+        Common setup for a batch job: prepares the save folder and progress bar,
+        then returns (manifest, files still to do). Inputs whose output is already
+        up to date for this operation and parameters are skipped. variants lists
+        several params dicts written together; an input is then skipped only if
+        all of its outputs are up to date.
+        """
+        os.makedirs(self.save_path, exist_ok=True)
+        self.progress['maximum'] = len(self.image_files)
+        self.processed_files.clear()
+        manifest = Manifest(self.save_path)
+        variants = variants or [params]
+
+        pending = []
+        for filepath in self.image_files:
+            suffixes = [operation_suffix(operation, variant, filepath) for variant in variants]
+            output_paths = [os.path.join(self.save_path, output_name(filepath, suffix)) for suffix in suffixes]
+            if self.incremental_var.get() and all(
+                    manifest.is_up_to_date(filepath, operation, variant, output_path)
+                    for variant, output_path in zip(variants, output_paths)):
+                self.processed_files.extend(output_paths)
+            else:
+                pending.append(filepath)
+        self.skipped_count = len(self.image_files) - len(pending)
+        self.progress['value'] = self.skipped_count
+        return manifest, pending
+
+    def skip_status(self):
+        return f", {self.skipped_count} up to date" if self.skipped_count else ""
+
+    def skip_note(self):
+        return f" ({self.skipped_count} up to date)" if self.skipped_count else ""
+
     def start_processing(self):
         if not self.save_path or not self.image_files:
             messagebox.showerror("Error", "Save folder or images not selected!")
             return
         self.stop_processing = False
         messagebox.showinfo("Processing", f"Starting to process {len(self.image_files)} image(s).")
-        self.processing_thread = threading.Thread(target=self.process_images, daemon=True)
+        self.processing_thread = threading.Thread(target=self.process_images, args=(self.model_name,), daemon=True)
         self.processing_thread.start()
 
-    def process_images(self):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+    def process_images(self, model_name):
+        params = {"model": model_name, "refine": self.refine_var.get(), "large_image_mp": self.large_image_mp(),
+                  "animation_format": self.animation_format_var.get(), "encoder": self.encoder_var.get(),
+                  "output_mode": self.output_mode_var.get()}
+        manifest, pending = self._start_job("remove_bg", params)
+
+        if self.worker_count > 1 and len(pending) > 1:
+            completed = self._process_images_pool(model_name, pending, manifest, params)
+            stats = f"{model_name}, {self.worker_count} worker processes{self.cache_status()}"
+        else:
+            completed = self._process_images_pipelined(model_name, pending, manifest, params)
+            stats = f"{model_name}, {self.stage_utilization}{self.cache_status()}"
+        if not completed:
+            self.status_label.config(text="Processing Stopped" if self.stop_processing else "Processing Failed")
+            return
+
+        self.status_label.config(text=f"Processing Completed! ({stats}{self.skip_status()})")
+        messagebox.showinfo("Done", "All images have been processed.")
+        self.open_save_folder()
+
+    def _process_images_pipelined(self, model_name, filepaths, manifest, params):
+        total = len(self.image_files)
+        done = self.skipped_count
+        pipeline = Pipeline(should_stop=lambda: self.stop_processing)
+        self.status_label.config(text=f"Processing image {done+1} of {total}{self.cache_status()}")
+        results = pipeline.run(
+            filepaths, self.save_path, self.session_pool.get(model_name), self.mask_cache,
+            self.large_image_mp(), self.refine_var.get(), self.batch_size, self.animation_format_var.get(),
+            self.encoder_var.get(), self.output_mode_var.get()
+        )
+        for filepath, output_path, error in results:
+            if error is not None:
+                messagebox.showerror("Error", f"Failed to process {os.path.basename(filepath)}: {str(error)}")
+            else:
+                self.processed_files.append(output_path)
+                manifest.record(filepath, "remove_bg", params, output_path)
+
+            done += 1
+            self.status_label.config(text=f"Processing image {done} of {total}{self.cache_status()}")
+            self.progress['value'] = done
+            self.root.update_idletasks()
+
+        self.stage_utilization = pipeline.utilization_text()
+        return not self.stop_processing
+
+    def _get_process_pool(self, model_name):
+        """
+        Returns a process pool whose workers hold a warm session for the current
+        model. The pool is reused until the worker count, model or ORT settings change.
+        """
+        key = (self.worker_count, model_name, json.dumps(self.ort_settings, sort_keys=True))
+        if self.process_pool is None or self.process_pool_key != key:
+            self.shutdown_process_pool()
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.worker_count,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_remove_worker,
+                initargs=(model_name, self.ort_settings, self.worker_count,
+                          MASK_CACHE_DIR, MASK_CACHE_MB if self.mask_cache else 0)
+            )
+            self.process_pool_key = key
+        return self.process_pool
+
+    def shutdown_process_pool(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+            self.process_pool_key = None
+
+    def _process_pool_failed(self, error, futures):
+        for pending in futures:
+            pending.cancel()
+        # A broken pool stays broken; the next run starts a fresh one
+        self.shutdown_process_pool()
+        messagebox.showerror("Error", f"Worker processes failed: {str(error)}")
+        return False
+
+    def _process_images_pool(self, model_name, filepaths, manifest, params):
+        total = len(self.image_files)
+        self.status_label.config(text=f"Starting {self.worker_count} worker processes...")
+        futures = []
+        try:
+            pool = self._get_process_pool(model_name)
+            futures = [pool.submit(_remove_worker, batch, self.save_path, self.large_image_mp(),
+                                   self.refine_var.get(), self.animation_format_var.get(), self.encoder_var.get(),
+                                   self.output_mode_var.get())
+                       for batch in chunked(filepaths, self.batch_size)]
+        except Exception as e:
+            return self._process_pool_failed(e, futures)
 
-        for i, filepath in enumerate(self.image_files):
+        done = self.skipped_count
+        # Results stream back in completion order
+        for future in as_completed(futures):
             if self.stop_processing:
-                self.status_label.config(text="Processing Stopped")
-                return
+                for pending in futures:
+                    pending.cancel()
+                return False
 
-            self.status_label.config(text=f"Processing image {i+1} of {len(self.image_files)}")
             try:
-                input_image = Image.open(filepath).convert("RGBA")
-                output_image = remove(input_image)
-                filename = os.path.splitext(os.path.basename(filepath))[0] + "_nobg.png"
-                output_path = os.path.join(self.save_path, filename)
-                output_image.save(output_path, format="PNG")
-                self.processed_files.append(output_path)
+                results, hits, misses = future.result()
+            except Exception as e:
+                # Per-image errors come back in results; this is the pool itself
+                # (a killed worker, a failed initializer, a pickling error)
+                return self._process_pool_failed(e, futures)
+            if self.mask_cache:
+                self.mask_cache.hits += hits
+                self.mask_cache.misses += misses
+            for filepath, output_path, error in results:
+                if error is not None:
+                    messagebox.showerror("Error", f"Failed to process {os.path.basename(filepath)}: {str(error)}")
+                else:
+                    self.processed_files.append(output_path)
+                    manifest.record(filepath, "remove_bg", params, output_path)
+                done += 1
 
-                self.progress['value'] = i + 1
-                self.root.update_idletasks()
+            self.status_label.config(text=f"Processing image {done} of {total}{self.cache_status()}")
+            self.progress['value'] = done
+            self.root.update_idletasks()
+        return True
+
+    def benchmark_batch_sizes(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        self.status_label.config(text="Benchmarking batch sizes...")
+        threading.Thread(target=self._benchmark_batch_sizes_thread, daemon=True).start()
+
+    def _benchmark_batch_sizes_thread(self):
+        try:
+            # Enough images for at least two calls at the largest batch size
+            sample = self.image_files[:max(BENCHMARK_BATCH_SIZES) * 2]
+            images = [load_image(f) for f in sample]
+            results = benchmark_batch_sizes(self.session_pool.get(self.model_name), images)
+        except Exception as e:
+            messagebox.showerror("Error", f"Benchmark failed: {str(e)}")
+            return
+        lines = [f"Batch {size}: {rate:.2f} images/sec" for size, rate in results.items()]
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "Batch Size Benchmark",
+            f"{self.model_name} on {len(images)} image(s), CPU:\n\n" + "\n".join(lines)
+        )
+
+    def benchmark_models(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        models = [model_name for model_name, _ in MODEL_TIERS if model_installed(model_name)]
+        models += [model_name + INT8_SUFFIX for model_name in models
+                   if os.path.exists(quantized_model_path(model_name))]
+        if not models:
+            messagebox.showerror("Error", "No rembg models are installed yet.")
+            return
+        self.status_label.config(text=f"Benchmarking {len(models)} model(s)...")
+        threading.Thread(target=self._benchmark_models_thread, args=(models,), daemon=True).start()
+
+    def _benchmark_models_thread(self, models):
+        sample = self.image_files[:BENCHMARK_SAMPLE_SIZE]
+        lines = []
+        for model_name in models:
+            self.status_label.config(text=f"Benchmarking {model_name}...")
+            try:
+                # One fresh process per model so peak RSS is not shared between models
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    ms_per_image, peak_rss = pool.submit(
+                        _benchmark_model_worker, model_name, self.ort_settings, sample
+                    ).result()
+                lines.append(f"{model_name}: {ms_per_image:.0f} ms/image, peak RSS {peak_rss / 1024 ** 2:.0f} MB")
             except Exception as e:
-                messagebox.showerror("Error", f"Failed to process {os.path.basename(filepath)}: {str(e)}")
+                lines.append(f"{model_name}: failed ({str(e)})")
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "Model Benchmark",
+            f"{len(sample)} sample image(s):\n\n" + "\n".join(lines)
+        )
 
-        self.status_label.config(text="Processing Completed!")
-        messagebox.showinfo("Done", "All images have been processed.")
-        self.open_save_folder()
+    def benchmark_int8(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        model_name = base_model_name(self.model_name)
+        self.status_label.config(text=f"Benchmarking {model_name} INT8 vs FP32...")
+        threading.Thread(target=self._benchmark_int8_thread, args=(model_name,), daemon=True).start()
+
+    def _benchmark_int8_thread(self, model_name):
+        sample = self.image_files[:BENCHMARK_SAMPLE_SIZE]
+        try:
+            fp32_ms, int8_ms, ious = _benchmark_int8_worker(model_name, self.ort_settings, sample)
+        except Exception as e:
+            messagebox.showerror("Error", f"Benchmark failed: {str(e)}")
+            return
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "INT8 vs FP32",
+            f"{model_name} on {len(sample)} sample image(s):\n\n"
+            f"FP32: {fp32_ms:.0f} ms/image\n"
+            f"INT8: {int8_ms:.0f} ms/image\n"
+            f"Speedup: {fp32_ms / int8_ms:.2f}x\n"
+            f"Mask IoU vs FP32: mean {np.mean(ious):.3f}, worst {min(ious):.3f}"
+        )
+
+    def benchmark_refinement(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        level = self.refine_var.get()
+        if level == "off":
+            level = "balanced"
+        self.status_label.config(text=f"Benchmarking {level} refinement vs alpha matting...")
+        threading.Thread(target=self._benchmark_refinement_thread, args=(level,), daemon=True).start()
+
+    def _benchmark_refinement_thread(self, level):
+        # Alpha matting is slow, so only a few images are compared
+        sample = self.image_files[:BENCHMARK_MATTING_SAMPLE_SIZE]
+        totals = np.zeros(4)
+        try:
+            session = self.session_pool.get(self.model_name)
+            for filepath in sample:
+                img = load_image(filepath)
+                mask = cached_predict_masks(session, [filepath], [img], self.mask_cache)[0]
+                totals += benchmark_edge_refinement(img, mask, level)
+        except Exception as e:
+            messagebox.showerror("Error", f"Benchmark failed: {str(e)}")
+            return
+        refine_time, matting_time, raw_error, refined_error = totals / len(sample)
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "Edge Refinement Benchmark",
+            f"{len(sample)} sample image(s), {level} refinement:\n\n"
+            f"Guided filter: {refine_time * 1000:.0f} ms/image\n"
+            f"Alpha matting: {matting_time * 1000:.0f} ms/image "
+            f"({matting_time / max(refine_time, 1e-9):.0f}x slower)\n\n"
+            f"Edge error vs alpha matting (mean |alpha| difference in the boundary band):\n"
+            f"Raw mask: {raw_error:.3f}\n"
+            f"Refined: {refined_error:.3f}"
+        )
+
+    def benchmark_encoders(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        self.status_label.config(text="Benchmarking output encoders...")
+        threading.Thread(target=self._benchmark_encoders_thread, daemon=True).start()
+
+    def _benchmark_encoders_thread(self):
+        sample = self.image_files[:BENCHMARK_SAMPLE_SIZE]
+        try:
+            cutouts = encoder_benchmark_images(sample, self.session_pool.get(self.model_name), self.mask_cache)
+            report = benchmark_encoders(cutouts)
+        except Exception as e:
+            messagebox.showerror("Error", f"Benchmark failed: {str(e)}")
+            return
+        baseline = report["png"][1]
+        lines = [
+            f"{OUTPUT_ENCODERS[encoder]['label']}: {seconds * 1000:.0f} ms, {size / 1024:.0f} KB "
+            f"({size / baseline:.0%} of PNG)"
+            for encoder, (seconds, size) in sorted(report.items(), key=lambda item: item[1][0])
+        ]
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "Output Encoder Benchmark",
+            f"Encode time and size per cutout, {len(sample)} sample image(s), fastest first:\n\n" + "\n".join(lines)
+        )
+
+    def benchmark_decode(self):
+        if not self.image_files:
+            messagebox.showerror("Error", "No images imported!")
+            return
+        self.status_label.config(text="Benchmarking reduced decode...")
+        threading.Thread(target=self._benchmark_decode_thread, daemon=True).start()
+
+    def _benchmark_decode_thread(self):
+        sample = self.image_files[:BENCHMARK_SAMPLE_SIZE]
+        try:
+            report = benchmark_decode(sample)
+        except Exception as e:
+            messagebox.showerror("Error", f"Benchmark failed: {str(e)}")
+            return
+        lines = [
+            f"{task.capitalize()}: {full * 1000:.0f} ms -> {reduced * 1000:.0f} ms "
+            f"({full / max(reduced, 1e-9):.1f}x), {full_bytes / 2**20:.0f} MB -> {reduced_bytes / 2**20:.1f} MB"
+            for task, (full, reduced, full_bytes, reduced_bytes) in report.items()
+        ]
+        self.status_label.config(text="Benchmark Completed!")
+        messagebox.showinfo(
+            "Reduced Decode Benchmark",
+            f"Full decode vs reduced decode per image, {len(sample)} sample image(s)\n"
+            f"(memory is the largest decoded pixel buffer):\n\n" + "\n".join(lines)
+        )
 
     def end_processing(self):
         if self.processing_thread and self.processing_thread.is_alive():
@@ -618,9 +3773,10 @@ class ImageProcessorApp:
         self.stop_processing = False
         messagebox.showinfo("Smart Crop", f"Starting Smart Crop for {len(self.image_files)} image(s).")
 
+        params = {"ratio": [width_ratio, height_ratio], "model": self.model_name, "encoder": self.encoder_var.get()}
         self.processing_thread = threading.Thread(
-            target=self._smart_crop_thread, 
-            args=(width_ratio, height_ratio), 
+            target=self._smart_crop_thread,
+            args=([params],),
             daemon=True
         )
         self.processing_thread.start()
@@ -635,80 +3791,85 @@ class ImageProcessorApp:
             except ValueError:
                 messagebox.showerror("Error", "Invalid ratio format! Use e.g. 4:3")
 
-    def _smart_crop_thread(self, width_ratio, height_ratio):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
-
-        for i, filepath in enumerate(self.image_files):
-            if self.stop_processing:
-                self.status_label.config(text="Cropping Stopped")
+    def smart_crop_multi(self, variants=None):
+        """
+        Several ratios and/or pixel sizes from one decode and subject search per
+        image. Without variants, asks for a list like "1:1, 4:6, 800x1200".
+        """
+        if not self.save_path or not self.image_files:
+            messagebox.showerror("Error", "Save folder or images not selected!")
+            return
+        if variants is None:
+            spec = simpledialog.askstring("Multiple Crops", "Enter ratios and/or pixel sizes "
+                                                             "(e.g., 1:1, 4:6, 16:9, 800x1200):")
+            if not spec:
                 return
-            self.status_label.config(text=f"Smart Cropping {i+1} of {len(self.image_files)}")
-
             try:
-                img = Image.open(filepath).convert("RGBA")
-                width, height = img.size
-
-                # Downscale for faster face detection
-                small_img = img.resize((int(width * 0.25), int(height * 0.25)), Image.Resampling.BILINEAR)
-                small_array = np.array(small_img.convert("RGB"))
-                face_locations = face_recognition.face_locations(small_array, model="hog")
-
-                if face_locations:
-                    # Found a face -> scale back up
-                    top, right, bottom, left = [x * 4 for x in face_locations[0]]
-                else:
-                    # No face: try rembg mask
-                    mask = remove(img, only_mask=True)
-                    coords = np.where(np.array(mask) > 0)
-                    if len(coords[0]) == 0:
-                        raise ValueError("No subject detected!")
-                    top, bottom = coords[0].min(), coords[0].max()
-                    left, right = coords[1].min(), coords[1].max()
-
-                face_width = right - left
-                face_height = bottom - top
-                center_x, center_y = (left + right) // 2, (top + bottom) // 2
-                aspect_ratio = width_ratio / height_ratio
-
-                if face_width / face_height > aspect_ratio:
-                    crop_height = min(face_height * 2, height)
-                    crop_width = int(crop_height * aspect_ratio)
-                else:
-                    crop_width = min(face_width * 2, width)
-                    crop_height = int(crop_width / aspect_ratio)
-
-                crop_left = max(0, center_x - crop_width // 2)
-                crop_right = crop_left + crop_width
-                crop_top = max(0, center_y - crop_height // 2)
-                crop_bottom = crop_top + crop_height
-
-                # Adjust if out of bounds
-                if crop_right > width:
-                    crop_left = width - crop_width
-                if crop_bottom > height:
-                    crop_top = height - crop_height
-                if crop_left < 0:
-                    crop_left = 0
-                if crop_top < 0:
-                    crop_top = 0
-
-                cropped_img = img.crop((crop_left, crop_top, crop_right, crop_bottom))
-                filename = os.path.splitext(os.path.basename(filepath))[0] + f"_crop_{width_ratio}x{height_ratio}.png"
-                output_path = os.path.join(self.save_path, filename)
-                cropped_img.save(output_path, format="PNG")
-                self.processed_files.append(output_path)
+                ratios, sizes = parse_crop_spec(spec)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            variants = crop_variants(ratios, sizes, self.model_name, self.encoder_var.get())
+        self.stop_processing = False
+        messagebox.showinfo("Smart Crop", f"Starting Smart Crop ({len(variants)} crops each) "
+                                          f"for {len(self.image_files)} image(s).")
+        self.processing_thread = threading.Thread(target=self._smart_crop_thread, args=(variants,), daemon=True)
+        self.processing_thread.start()
 
-                self.progress['value'] = i + 1
-                self.root.update_idletasks()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to crop {os.path.basename(filepath)}: {str(e)}")
+    def _smart_crop_thread(self, variants):
+        manifest, pending = self._start_job("smart_crop", variants[0], variants)
+        model_name = variants[0]["model"]
+
+        stats = LocalizerStats()
+        face_workers = self.worker_count if self.worker_count > 1 else FACE_WORKERS
+        pooled = face_workers > 1 and len(pending) > 1
+        if pooled:
+            self.status_label.config(
+                text=f"Starting {split_core_budget(face_workers, SMART_CROP_MASK_WORKERS)[0]} localizer processes..."
+            )
+            results = run_smart_crop_pools(pending, self.save_path, variants, face_workers, SMART_CROP_MASK_WORKERS,
+                                           self.ort_settings, MASK_CACHE_MB if self.mask_cache else 0,
+                                           lambda: self.stop_processing, stats)
+        else:
+            results = self._smart_crop_in_process(pending, variants, model_name, stats)
 
-        self.status_label.config(text="Smart Cropping Completed!")
+        for i, (filepath, output_paths, error) in enumerate(results, start=self.skipped_count):
+            if self.stop_processing:
+                break
+            if error is not None:
+                messagebox.showerror("Error", f"Failed to crop {os.path.basename(filepath)}: {str(error)}")
+            else:
+                for params, output_path in zip(variants, output_paths):
+                    self.processed_files.append(output_path)
+                    manifest.record(filepath, "smart_crop", params, output_path)
+            self.status_label.config(
+                text=f"Smart Cropping {i + 1} of {len(self.image_files)} ({stats.summary()}{self.cache_status()})"
+            )
+            self.progress['value'] = i + 1
+            self.root.update_idletasks()
+
+        if self.stop_processing:
+            self.status_label.config(text="Cropping Stopped")
+            return
+        if pooled:
+            workers = f"{split_core_budget(face_workers, SMART_CROP_MASK_WORKERS)[0]} localizer processes"
+        else:
+            workers = self.session_pool.stats_text()
+        self.status_label.config(
+            text=f"Smart Cropping Completed! ({workers}; resolved by {stats.summary()}{self.skip_status()})"
+        )
         messagebox.showinfo("Smart Crop Done", "All images have been smart-cropped.")
         self.open_save_folder()
 
+    def _smart_crop_in_process(self, filepaths, variants, model_name, stats):
+        for filepath in filepaths:
+            try:
+                yield filepath, smart_crop_file(filepath, self.save_path, variants,
+                                                lambda model=None: self.session_pool.get(model or model_name),
+                                                self.mask_cache, stats), None
+            except Exception as e:
+                yield filepath, None, e
+
     # ----------------------------------------------------------------
     #          FAST CROP (Simple center-based crop)
     # ----------------------------------------------------------------
@@ -735,43 +3896,26 @@ class ImageProcessorApp:
                 messagebox.showerror("Error", "Invalid format! Use '200x300'")
 
     def _fast_crop_thread(self, width, height):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+        params = {"size": [width, height], "encoder": self.encoder_var.get()}
+        manifest, pending = self._start_job("fast_crop", params)
 
-        for i, filepath in enumerate(self.image_files):
+        for i, filepath in enumerate(pending, start=self.skipped_count):
             if self.stop_processing:
                 self.status_label.config(text="Cropping Stopped")
                 return
             self.status_label.config(text=f"Fast Cropping {i+1} of {len(self.image_files)}")
 
             try:
-                img = Image.open(filepath)
-                img_w, img_h = img.size
-
-                left = (img_w - width) // 2
-                top = (img_h - height) // 2
-                right = left + width
-                bottom = top + height
-
-                # Adjust
-                left = max(0, left)
-                top = max(0, top)
-                right = min(img_w, right)
-                bottom = min(img_h, bottom)
-
-                cropped_img = img.crop((left, top, right, bottom))
-                filename = os.path.splitext(os.path.basename(filepath))[0] + f"_fastcrop_{width}x{height}.png"
-                output_path = os.path.join(self.save_path, filename)
-                cropped_img.save(output_path, format="PNG")
+                output_path = run_operation_file(filepath, self.save_path, "fast_crop", params)
 
                 self.processed_files.append(output_path)
+                manifest.record(filepath, "fast_crop", params, output_path)
                 self.progress['value'] = i + 1
                 self.root.update_idletasks()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to fast crop {os.path.basename(filepath)}: {str(e)}")
 
-        self.status_label.config(text="Fast Cropping Completed!")
+        self.status_label.config(text=f"Fast Cropping Completed!{self.skip_note()}")
         messagebox.showinfo("Fast Crop Done", "All images have been fast-cropped.")
         self.open_save_folder()
 
@@ -789,30 +3933,26 @@ class ImageProcessorApp:
                 messagebox.showerror("Error", "Invalid format! Use '800x600'")
 
     def _resize_all_thread(self, width, height):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+        params = {"size": [width, height], "encoder": self.encoder_var.get()}
+        manifest, pending = self._start_job("resize", params)
         self.status_label.config(text="Resizing...")
 
-        for i, filepath in enumerate(self.image_files):
+        for i, filepath in enumerate(pending, start=self.skipped_count):
             if self.stop_processing:
                 self.status_label.config(text="Resizing Stopped")
                 return
             self.status_label.config(text=f"Resizing {i+1} of {len(self.image_files)}")
 
             try:
-                img = Image.open(filepath)
-                resized_img = img.resize((width, height), Image.Resampling.LANCZOS)
-                filename = os.path.splitext(os.path.basename(filepath))[0] + f"_resized_{width}x{height}.png"
-                output_path = os.path.join(self.save_path, filename)
-                resized_img.save(output_path, format="PNG")
+                output_path = run_operation_file(filepath, self.save_path, "resize", params)
                 self.processed_files.append(output_path)
+                manifest.record(filepath, "resize", params, output_path)
                 self.progress['value'] = i + 1
                 self.root.update_idletasks()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to resize {os.path.basename(filepath)}: {str(e)}")
 
-        self.status_label.config(text="Resizing Completed!")
+        self.status_label.config(text=f"Resizing Completed!{self.skip_note()}")
         messagebox.showinfo("Resize Done", "All images have been resized.")
         self.open_save_folder()
 
@@ -842,40 +3982,78 @@ class ImageProcessorApp:
         )
         self.processing_thread.start()
 
-    def _convert_to_jpg_thread(self, background_color):
-        os.makedirs(self.save_path, exist_ok=True)
+    def composite_masks(self, mode):
+        """
+        Build outputs from the selected _mask.png files (written with the mask-only
+        output setting); each mask remembers its source image.
+        """
+        if not self.save_path or not self.image_files:
+            messagebox.showerror("Error", "Save folder or mask files not selected!")
+            return
+        background = (255, 255, 255)
+        if mode == "jpg":
+            color = colorchooser.askcolor(title="Select Background Color", initialcolor="#FFFFFF")
+            if color[1] is None:
+                return  # user cancelled
+            background = tuple(int(color[1][i:i + 2], 16) for i in (1, 3, 5))
+
+        self.stop_processing = False
         self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+        self.progress['value'] = 0
+        self.processing_thread = threading.Thread(
+            target=self._composite_masks_thread,
+            args=(mode, background),
+            daemon=True
+        )
+        self.processing_thread.start()
 
-        for i, filepath in enumerate(self.image_files):
+    def _composite_masks_thread(self, mode, background):
+        done, failed = 0, []
+        batch_size = max(1, self.batch_size)
+        for start in range(0, len(self.image_files), batch_size):
+            if self.stop_processing:
+                self.status_label.config(text="Compositing Stopped")
+                return
+            self.status_label.config(text=f"Compositing {start + 1} of {len(self.image_files)}")
+            batch = self.image_files[start:start + batch_size]
+            for mask_path, output_path, error in composite_batch(batch, self.save_path, mode, background,
+                                                                 self.encoder_var.get(), batch_size):
+                done += 1
+                if error is not None:
+                    failed.append(f"{os.path.basename(mask_path)}: {error}")
+                else:
+                    self.processed_files.append(output_path)
+                self.progress['value'] = done
+            self.root.update_idletasks()
+
+        self.status_label.config(text="Compositing Completed!")
+        if failed:
+            messagebox.showerror("Error", "Some masks could not be composited:\n" + "\n".join(failed[:10]))
+        else:
+            messagebox.showinfo("Compositing Done", f"Composited {done} image(s).")
+        self.open_save_folder()
+
+    def _convert_to_jpg_thread(self, background_color):
+        params = {"background": list(background_color)}
+        manifest, pending = self._start_job("convert_jpg", params)
+
+        for i, filepath in enumerate(pending, start=self.skipped_count):
             if self.stop_processing:
                 self.status_label.config(text="Conversion Stopped")
                 return
             self.status_label.config(text=f"Converting {i+1} of {len(self.image_files)}")
 
             try:
-                img = Image.open(filepath)
-                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                    # Paste onto background if alpha
-                    bg = Image.new('RGB', img.size, background_color)
-                    if img.mode != 'RGBA':
-                        img = img.convert('RGBA')
-                    bg.paste(img, (0, 0), img.split()[3])  # alpha mask
-                    img = bg
-                else:
-                    img = img.convert("RGB")
-
-                filename = os.path.splitext(os.path.basename(filepath))[0] + "_converted.jpg"
-                output_path = os.path.join(self.save_path, filename)
-                img.save(output_path, format="JPEG", quality=95)
+                output_path = run_operation_file(filepath, self.save_path, "convert_jpg", params)
                 self.processed_files.append(output_path)
+                manifest.record(filepath, "convert_jpg", params, output_path)
 
                 self.progress['value'] = i + 1
                 self.root.update_idletasks()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to convert {os.path.basename(filepath)}: {str(e)}")
 
-        self.status_label.config(text="Conversion Completed!")
+        self.status_label.config(text=f"Conversion Completed!{self.skip_note()}")
         messagebox.showinfo("Conversion Done", "All images have been converted to JPG.")
         self.open_save_folder()
 
@@ -902,29 +4080,26 @@ class ImageProcessorApp:
         self.processing_thread.start()
 
     def _rotate_images_thread(self, angle):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+        params = {"angle": angle, "encoder": self.encoder_var.get(),
+                  "orientation_only": self.orientation_only_var.get()}
+        manifest, pending = self._start_job("rotate", params)
 
-        for i, filepath in enumerate(self.image_files):
+        for i, filepath in enumerate(pending, start=self.skipped_count):
             if self.stop_processing:
                 self.status_label.config(text="Rotation Stopped")
                 return
 
             self.status_label.config(text=f"Rotating {i+1} of {len(self.image_files)}")
             try:
-                img = Image.open(filepath)
-                rotated_img = img.rotate(angle, expand=True)
-                filename = os.path.splitext(os.path.basename(filepath))[0] + f"_rotated_{angle}.png"
-                output_path = os.path.join(self.save_path, filename)
-                rotated_img.save(output_path, format="PNG")
+                output_path = run_operation_file(filepath, self.save_path, "rotate", params)
                 self.processed_files.append(output_path)
+                manifest.record(filepath, "rotate", params, output_path)
                 self.progress['value'] = i + 1
                 self.root.update_idletasks()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to rotate {os.path.basename(filepath)}: {str(e)}")
 
-        self.status_label.config(text="Rotation Completed!")
+        self.status_label.config(text=f"Rotation Completed!{self.skip_note()}")
         messagebox.showinfo("Rotate Done", "All images have been rotated.")
         self.open_save_folder()
 
@@ -944,39 +4119,180 @@ class ImageProcessorApp:
         self.processing_thread.start()
 
     def _flip_images_thread(self, flip_type):
-        os.makedirs(self.save_path, exist_ok=True)
-        self.progress['maximum'] = len(self.image_files)
-        self.processed_files.clear()
+        params = {"flip_type": flip_type, "encoder": self.encoder_var.get(),
+                  "orientation_only": self.orientation_only_var.get()}
+        manifest, pending = self._start_job("flip", params)
 
-        for i, filepath in enumerate(self.image_files):
+        for i, filepath in enumerate(pending, start=self.skipped_count):
             if self.stop_processing:
                 self.status_label.config(text="Flip Stopped")
                 return
 
             self.status_label.config(text=f"Flipping {i+1} of {len(self.image_files)}")
             try:
-                img = Image.open(filepath)
-                if flip_type == 'horizontal':
-                    flipped_img = img.transpose(Image.FLIP_LEFT_RIGHT)
-                    suffix = "_flippedH"
-                else:
-                    flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
-                    suffix = "_flippedV"
-
-                filename = os.path.splitext(os.path.basename(filepath))[0] + suffix + ".png"
-                output_path = os.path.join(self.save_path, filename)
-                flipped_img.save(output_path, format="PNG")
+                output_path = run_operation_file(filepath, self.save_path, "flip", params)
                 self.processed_files.append(output_path)
+                manifest.record(filepath, "flip", params, output_path)
 
                 self.progress['value'] = i + 1
                 self.root.update_idletasks()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to flip {os.path.basename(filepath)}: {str(e)}")
 
-        self.status_label.config(text="Flipping Completed!")
+        self.status_label.config(text=f"Flipping Completed!{self.skip_note()}")
         messagebox.showinfo("Flip Done", "All images have been flipped.")
         self.open_save_folder()
 
+    # ----------------------------------------------------------------
+    #       RECIPES (several operations per image, in memory)
+    # ----------------------------------------------------------------
+    def fill_recipe_menu(self, menu):
+        # Saved recipes are read again every time the menu opens
+        menu.delete(0, 'end')
+        names = list_recipes()
+        for name in names:
+            menu.add_command(label=name, command=lambda name=name: self.run_recipe(name))
+        if not names:
+            menu.add_command(label="(no saved recipes)", state='disabled')
+
+    def show_recipe_builder(self):
+        builder_window = tk.Toplevel(self.root)
+        builder_window.title("New Recipe")
+        builder_window.geometry("460x380")
+        builder_window.columnconfigure(1, weight=1)
+
+        ttk.Label(builder_window, text="Name").grid(row=0, column=0, sticky='w', padx=10, pady=5)
+        name_var = tk.StringVar()
+        ttk.Entry(builder_window, textvariable=name_var).grid(row=0, column=1, columnspan=3, sticky='ew',
+                                                              padx=10, pady=5)
+
+        steps_list = tk.Listbox(builder_window, height=8)
+        steps_list.grid(row=1, column=0, columnspan=4, sticky='nsew', padx=10, pady=5)
+        builder_window.rowconfigure(1, weight=1)
+
+        kinds = {"remove-bg": "", "smart-crop": "1:1", "fast-crop": "200x200", "resize": "800x800",
+                 "to-jpg": "#FFFFFF", "rotate": "90", "flip": "horizontal"}
+        kind_var = tk.StringVar(value="remove-bg")
+        value_var = tk.StringVar()
+        kind_box = ttk.Combobox(builder_window, textvariable=kind_var, values=list(kinds), state='readonly', width=12)
+        kind_box.grid(row=2, column=0, sticky='w', padx=10, pady=5)
+        kind_box.bind("<<ComboboxSelected>>", lambda event: value_var.set(kinds[kind_var.get()]))
+        ttk.Entry(builder_window, textvariable=value_var).grid(row=2, column=1, sticky='ew', padx=10, pady=5)
+
+        def add_step():
+            token = kind_var.get() + (f"={value_var.get().strip()}" if value_var.get().strip() else "")
+            try:
+                parse_chain(token)
+            except argparse.ArgumentTypeError as e:
+                messagebox.showerror("Error", str(e), parent=builder_window)
+                return
+            steps_list.insert('end', token)
+
+        def move_step(offset):
+            selection = steps_list.curselection()
+            if not selection:
+                return
+            index = selection[0]
+            target = index + offset
+            if 0 <= target < steps_list.size():
+                token = steps_list.get(index)
+                steps_list.delete(index)
+                steps_list.insert(target, token)
+                steps_list.selection_set(target)
+
+        def remove_step():
+            for index in reversed(steps_list.curselection()):
+                steps_list.delete(index)
+
+        ttk.Button(builder_window, text="Add", command=add_step).grid(row=2, column=2, padx=5, pady=5)
+        buttons = ttk.Frame(builder_window)
+        buttons.grid(row=3, column=0, columnspan=4, pady=5)
+        ttk.Button(buttons, text="Remove", command=remove_step).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Up", command=lambda: move_step(-1)).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Down", command=lambda: move_step(1)).pack(side='left', padx=5)
+
+        def save(run):
+            name = name_var.get().strip()
+            spec = ",".join(steps_list.get(0, 'end'))
+            if not name or not spec:
+                messagebox.showerror("Error", "Give the recipe a name and at least one step.", parent=builder_window)
+                return
+            if os.sep in name or (os.altsep and os.altsep in name):
+                messagebox.showerror("Error", "Recipe names cannot contain path separators.", parent=builder_window)
+                return
+            try:
+                save_recipe(name, chain_spec(parse_chain(spec)))
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save recipe: {str(e)}", parent=builder_window)
+                return
+            self.status_label.config(text=f"Recipe '{name}' saved")
+            builder_window.destroy()
+            if run:
+                self.run_recipe(name)
+
+        actions = ttk.Frame(builder_window)
+        actions.grid(row=4, column=0, columnspan=4, pady=10)
+        ttk.Button(actions, text="Save", command=lambda: save(False), style="Cool.TButton").pack(side='left', padx=5)
+        ttk.Button(actions, text="Save && Run", command=lambda: save(True),
+                   style="Cool.TButton").pack(side='left', padx=5)
+
+    def run_recipe(self, name):
+        if not self.save_path or not self.image_files:
+            messagebox.showerror("Error", "Save folder or images not selected!")
+            return
+        try:
+            chain = parse_chain(load_recipe(name))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load recipe '{name}': {str(e)}")
+            return
+        self.stop_processing = False
+        messagebox.showinfo("Run Recipe", f"Starting recipe '{name}' ({len(chain)} steps) "
+                                          f"for {len(self.image_files)} image(s).")
+        self.processing_thread = threading.Thread(target=self._run_recipe_thread, args=(name, chain), daemon=True)
+        self.processing_thread.start()
+
+    def _run_recipe_thread(self, name, chain):
+        params = {"steps": chain_steps(chain, self.model_name, self.refine_var.get(), self.large_image_mp(),
+                                       self.animation_format_var.get(), self.encoder_var.get())}
+        manifest, pending = self._start_job("chain", params)
+
+        workers = self.worker_count if self.worker_count > 1 else CHAIN_WORKERS
+        if workers > 1 and len(pending) > 1:
+            self.status_label.config(text=f"Starting {workers} worker processes...")
+            results = run_operation_batch("chain", pending, self.save_path, params, workers,
+                                          ort_settings=self.ort_settings,
+                                          cache_mb=MASK_CACHE_MB if self.mask_cache else 0,
+                                          should_stop=lambda: self.stop_processing)
+        else:
+            results = self._recipe_in_process(pending, params)
+
+        for i, (filepath, output_path, error) in enumerate(results, start=self.skipped_count):
+            if self.stop_processing:
+                break
+            if error is not None:
+                messagebox.showerror("Error", f"Recipe failed on {os.path.basename(filepath)}: {str(error)}")
+            else:
+                self.processed_files.append(output_path)
+                manifest.record(filepath, "chain", params, output_path)
+            self.status_label.config(text=f"Recipe '{name}': {i + 1} of {len(self.image_files)}{self.cache_status()}")
+            self.progress['value'] = i + 1
+            self.root.update_idletasks()
+
+        if self.stop_processing:
+            self.status_label.config(text="Recipe Stopped")
+            return
+        self.status_label.config(text=f"Recipe '{name}' Completed!{self.skip_note()}")
+        messagebox.showinfo("Recipe Done", f"All images have been processed with '{name}'.")
+        self.open_save_folder()
+
+    def _recipe_in_process(self, filepaths, params):
+        for filepath in filepaths:
+            try:
+                yield filepath, run_chain_file(filepath, self.save_path, params["steps"], self.session_pool.get,
+                                               self.mask_cache), None
+            except Exception as e:
+                yield filepath, None, e
+
     # ----------------------------------------------------------------
     #          VIEW / MANAGE PROCESSED FILES
     # ----------------------------------------------------------------
@@ -1012,9 +4328,7 @@ class ImageProcessorApp:
             frame.pack(fill='x', pady=2)
             frame.columnconfigure(1, weight=1)
             try:
-                img = Image.open(filepath)
-                img.thumbnail((50, 50))
-                thumbnail = ImageTk.PhotoImage(img)
+                thumbnail = ImageTk.PhotoImage(open_reduced(filepath, THUMBNAIL_SIDE))
                 self.processed_thumbnails.append(thumbnail)
                 ttk.Label(frame, image=thumbnail).grid(row=0, column=0, padx=5)
             except Exception:
@@ -1069,9 +4383,7 @@ class ImageProcessorApp:
             label = ttk.Label(canvas)
             label_window_id = canvas.create_window((0, 0), window=label, anchor="center")
 
-            img = Image.open(filepath)
-            max_size = 400
-            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            img = open_reduced(filepath, PREVIEW_SIDE)
             base_size = max(img.size)
             zoom_factor = 1.0
 
@@ -1154,10 +4466,850 @@ class ImageProcessorApp:
         messagebox.showinfo("Deleted All", f"All {count} processed file(s) have been deleted.")
 
 
+# ---------------------------------------------------------------------
+#              Watch folder (long-running ingestion daemon)
+# ---------------------------------------------------------------------
+class FolderWatcher:
+    """
+    Polls an input folder and feeds each new image through a chain of
+    operations. A file is only picked up once its size and mtime have stayed
+    the same for settle_seconds, so partially copied files are left alone.
+    Sessions stay loaded for the life of the watcher, so each arrival costs
+    inference time only. Picked-up files wait in a bounded queue: when
+    arrivals outpace the workers the scanner stops queueing (files simply wait
+    on disk) until there is room again. Finished files are recorded in the save
+    folder's manifest, so a restarted watcher does not redo them.
+    """
+    def __init__(self, input_dir, save_path, steps, workers=1, recursive=False, ort_settings=None,
+                 cache_mb=MASK_CACHE_MB, poll_seconds=WATCH_POLL_SECONDS, settle_seconds=WATCH_SETTLE_SECONDS,
+                 queue_size=WATCH_QUEUE_SIZE, on_event=lambda event, **fields: None):
+        self.input_dir = input_dir
+        self.save_path = save_path
+        self.steps = steps
+        self.workers = workers
+        self.recursive = recursive
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.on_event = on_event
+        self.sessions = SessionPool(ort_settings)
+        self.mask_cache = create_mask_cache(MASK_CACHE_DIR, cache_mb)
+        self.manifest = Manifest(save_path)
+        self.params = {"steps": [[operation, params] for operation, params in steps]}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._pending = {}      # path -> ((size, mtime_ns), first seen unchanged at)
+        self._failed = {}       # path -> (size, mtime_ns) it failed with; retried once it changes
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        for operation, params in self.steps:
+            if operation in ("remove_bg", "smart_crop"):
+                self.sessions.get(params["model"])
+
+    def _stable_files(self):
+        """
+        Scan once; return (filepath, signature) for files that have stopped
+        changing and still need work.
+        """
+        now = time.monotonic()
+        seen = set()
+        stable = []
+        for filepath in collect_inputs([self.input_dir], self.recursive):
+            seen.add(filepath)
+            with self._lock:
+                if filepath in self._in_flight:
+                    continue
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue  # moved or deleted mid-scan
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self._pending.get(filepath)
+            if previous is None or previous[0] != signature:
+                self._pending[filepath] = (signature, now)
+                continue
+            if (stat.st_size == 0 or now - previous[1] < self.settle_seconds
+                    or self._failed.get(filepath) == signature):
+                continue
+            output_path = chain_output_path(filepath, self.save_path, self.steps)
+            if self.manifest.is_up_to_date(filepath, "chain", self.params, output_path):
+                continue
+            stable.append((filepath, signature))
+        for filepath in set(self._pending) - seen:
+            del self._pending[filepath]
+        return stable
+
+    def _scan_loop(self):
+        throttled = False
+        while not self.stop_event.is_set():
+            for filepath, signature in self._stable_files():
+                # Marked before queueing, so a worker that finishes it straight away cannot be undone
+                with self._lock:
+                    self._in_flight.add(filepath)
+                try:
+                    self.queue.put_nowait((filepath, signature))
+                except queue.Full:
+                    with self._lock:
+                        self._in_flight.discard(filepath)
+                    if not throttled:
+                        self.on_event("backpressure", queued=self.queue.qsize())
+                        throttled = True
+                    break
+                throttled = False
+                self.on_event("queued", input=filepath, queued=self.queue.qsize())
+            self.stop_event.wait(self.poll_seconds)
+
+    def _work_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                filepath, signature = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            started = time.perf_counter()
+            try:
+                output_path = run_chain_file(filepath, self.save_path, self.steps, self.sessions.get,
+                                             self.mask_cache)
+                self.manifest.record(filepath, "chain", self.params, output_path)
+                self.processed += 1
+                self.on_event("processed", input=filepath, output=output_path,
+                              seconds=round(time.perf_counter() - started, 3), queued=self.queue.qsize())
+            except Exception as e:
+                self.failed += 1
+                with self._lock:
+                    self._failed[filepath] = signature
+                self.on_event("failed", input=filepath, error=str(e))
+            finally:
+                with self._lock:
+                    self._in_flight.discard(filepath)
+
+    def run(self):
+        """
+        Block until stop() is called (or KeyboardInterrupt).
+        """
+        os.makedirs(self.save_path, exist_ok=True)
+        self.warm_up()
+        threads = [threading.Thread(target=self._scan_loop, daemon=True)]
+        threads += [threading.Thread(target=self._work_loop, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        self.on_event("watching", input=os.path.abspath(self.input_dir), output=os.path.abspath(self.save_path),
+                      steps=self.params["steps"], workers=self.workers)
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# ---------------------------------------------------------------------
+#        Local HTTP service (warm session, dynamic request batching)
+# ---------------------------------------------------------------------
+class MaskBatcher:
+    """
+    Groups concurrent mask requests into batched inference calls. The first
+    waiting request opens a window of window_ms; every request that arrives
+    inside it (up to max_batch) runs through the model in the same call.
+    """
+    def __init__(self, session, window_ms=SERVE_BATCH_WINDOW_MS, max_batch=SERVE_MAX_BATCH):
+        self.session = session
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.batched_images = 0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def predict(self, img):
+        future = Future()
+        self.queue.put((img, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                masks = predict_masks(self.session, [img for img, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), mask in zip(batch, masks):
+                    future.set_result(mask)
+            self.batches += 1
+            self.batched_images += len(batch)
+
+
+class LatencyStats:
+    def __init__(self, window=SERVE_STATS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, ok=True):
+        with self._lock:
+            self.samples.append(seconds)
+            self.requests += 1
+            self.errors += 0 if ok else 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = np.array(self.samples) * 1000
+            requests, errors = self.requests, self.errors
+        p50, p99 = np.percentile(samples, [50, 99]) if len(samples) else (0.0, 0.0)
+        return {"requests": requests, "errors": errors, "p50_ms": round(float(p50), 2), "p99_ms": round(float(p99), 2)}
+
+
+class BackgroundRemovalServer(ThreadingHTTPServer):
+    """
+    POST /remove-bg[?output=mask][&refine=fast]   image body -> PNG cutout (or L mask)
+    POST /smart-crop[?ratio=4:3]                  image body -> cropped PNG (422 if no subject is found)
+    Both take &encoder=<OUTPUT_ENCODERS name>, e.g. encoder=webp.
+    GET  /stats                                   latency percentiles, queue depth, batching
+    """
+    daemon_threads = True
+
+    def __init__(self, address, session, refine=EDGE_REFINE, window_ms=SERVE_BATCH_WINDOW_MS,
+                 max_batch=SERVE_MAX_BATCH, ort_settings=None):
+        super().__init__(address, ServiceHandler)
+        self.model_name = session.model_name
+        self.refine = refine
+        self.batcher = MaskBatcher(session, window_ms, max_batch)
+        # Sessions for the other localizer models (the low-res mask stage)
+        self.sessions = SessionPool(ort_settings)
+        self.latency = LatencyStats()
+
+    def subject_box(self, img):
+        """
+        Smart Crop's localizer cascade, as in the GUI and CLI, except that the
+        full-resolution "mask" stage goes through the batcher. None if no
+        stage finds a subject.
+        """
+        stages = list(LOCALIZER_STAGES)
+        split = stages.index("mask") if "mask" in stages else len(stages)
+        def get_session(model=None):
+            return self.sessions.get(model or self.model_name)
+
+        box, _ = localize_subject(img, get_session, stages=stages[:split])
+        if box is not None or split == len(stages):
+            return box
+        mask = self.batcher.predict(img)
+        if mask.getbbox() is not None:
+            return mask_box(mask)
+        return localize_subject(img, get_session, stages=stages[split + 1:])[0]
+
+    def stats(self):
+        batcher = self.batcher
+        return {
+            **self.latency.snapshot(),
+            "queue_depth": batcher.queue.qsize(),
+            "batches": batcher.batches,
+            "mean_batch_size": round(batcher.batched_images / batcher.batches, 2) if batcher.batches else 0.0,
+            "model": self.model_name,
+        }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # per-request logging would dominate at high request rates; see /stats
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data).encode(), "application/json")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {path}"})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        ok = False
+        try:
+            if url.path not in ("/remove-bg", "/smart-crop"):
+                self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+                return
+            refine = query.get("refine", self.server.refine)
+            encoder = query.get("encoder", OUTPUT_ENCODER)
+            try:
+                if refine not in REFINE_LEVELS:
+                    raise ValueError(f"Unknown refine level {refine}")
+                if encoder not in OUTPUT_ENCODERS:
+                    raise ValueError(f"Unknown encoder {encoder}")
+                if url.path == "/smart-crop":
+                    width_ratio, height_ratio = _pair(":")(query.get("ratio", "1:1"))
+            except (ValueError, argparse.ArgumentTypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0 or length > SERVE_MAX_UPLOAD_MB * 1024 ** 2:
+                self._send_json(413 if length else 400, {"error": "Send the image as the request body"})
+                return
+            try:
+                img = load_image(io.BytesIO(self.rfile.read(length)))
+            except Exception as e:
+                self._send_json(400, {"error": f"Not a readable image: {e}"})
+                return
+
+            if url.path == "/remove-bg":
+                mask = self.server.batcher.predict(img)
+                mask = refine_mask(img, mask, refine)
+                result = mask if query.get("output") == "mask" else cutout(img, mask)
+            else:
+                box = self.server.subject_box(img)
+                if box is None:
+                    self._send_json(422, {"error": "No subject detected"})
+                    return
+                result = crop_to_subject(img, box, width_ratio, height_ratio)
+
+            body = io.BytesIO()
+            encode_image(result, body, encoder)
+            self._send(200, body.getvalue(), "image/" + OUTPUT_ENCODERS[encoder]["format"].lower())
+            ok = True
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        finally:
+            self.server.latency.add(time.perf_counter() - started, ok)
+
+
+def run_load_test(url, filepaths, concurrency=8, requests=100, endpoint="/remove-bg"):
+    """
+    Fire `requests` POSTs at a running service from `concurrency` threads,
+    cycling through filepaths. Returns client-side latency/throughput together
+    with the server's own /stats.
+    """
+    bodies = [open(filepath, "rb").read() for filepath in filepaths]
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    stats = LatencyStats(window=requests)
+
+    def client_loop():
+        with httpx.Client(base_url=url, timeout=60.0) as client:
+            while True:
+                with counter_lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    ok = client.post(endpoint, content=bodies[index % len(bodies)]).status_code == 200
+                except httpx.RequestError:
+                    ok = False
+                stats.add(time.perf_counter() - started, ok)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    with httpx.Client(base_url=url, timeout=10.0) as client:
+        server_stats = client.get("/stats").json()
+    return {**stats.snapshot(), "concurrency": concurrency, "seconds": round(seconds, 3),
+            "requests_per_second": round(requests / seconds, 2), "server": server_stats}
+
+
+# ---------------------------------------------------------------------
+#          Headless command line (no display or Tk required)
+# ---------------------------------------------------------------------
+def collect_inputs(patterns, recursive=False):
+    """
+    Expand files, directories and glob patterns into a de-duplicated, ordered
+    list of image files.
+    """
+    files = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*") if recursive else os.path.join(pattern, "*"),
+                                recursive=recursive)
+        else:
+            matches = glob.glob(pattern, recursive=recursive) or [pattern]
+        for path in sorted(matches):
+            if path not in seen and os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                seen.add(path)
+                files.append(path)
+    return files
+
+
+def _pair(separator):
+    def parse(value):
+        try:
+            a, b = map(int, value.split(separator))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected e.g. 4{separator}3, got {value!r}")
+        if a <= 0 or b <= 0:
+            raise argparse.ArgumentTypeError("both values must be positive")
+        return [a, b]
+    return parse
+
+
+def _hex_color(value):
+    digits = value.lstrip("#")
+    try:
+        if len(digits) != 6:
+            raise ValueError
+        return [int(digits[i:i + 2], 16) for i in (0, 2, 4)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a hex color like #FFFFFF, got {value!r}")
+
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(
+        prog="app.py",
+        description="Batch background removal and cropping without the GUI. "
+                    "Progress is printed to stdout as JSON lines."
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    common.add_argument("-o", "--output", default=DEFAULT_SAVE_PATH, help="save folder")
+    common.add_argument("-w", "--workers", type=int, default=PROCESS_WORKERS, help="worker processes")
+    common.add_argument("-r", "--recursive", action="store_true", help="descend into sub-directories")
+    common.add_argument("--force", action="store_true", help="redo outputs that are already up to date")
+    common.add_argument("--mask-cache-mb", type=int, default=MASK_CACHE_MB, help="mask cache budget (0 disables)")
+    common.add_argument("--encoder", choices=list(OUTPUT_ENCODERS), default=OUTPUT_ENCODER,
+                        help="output encoder (to-jpg always writes JPEG)")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("remove-bg", parents=[common], help="remove backgrounds")
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+    cmd.add_argument("--refine", choices=list(REFINE_LEVELS), default=EDGE_REFINE)
+    cmd.add_argument("--large-image-mp", type=float, default=LARGE_IMAGE_MP)
+    cmd.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    cmd.add_argument("--animation-format", choices=ANIMATION_FORMATS, default=ANIMATION_FORMAT,
+                     help="output for animated GIF/APNG/WebP inputs and frame folders")
+    cmd.add_argument("--frames", action="store_true",
+                     help="treat each input directory as one animation of numbered frames")
+    cmd.add_argument("--output-mode", choices=list(OUTPUT_MODES), default=OUTPUT_MODE,
+                     help="write cutouts, or only 8-bit/1-bit masks to composite later")
+
+    cmd = commands.add_parser("composite", help="build outputs from masks written with --output-mode mask")
+    cmd.add_argument("inputs", nargs="+", help="_mask.png files, directories or glob patterns")
+    cmd.add_argument("-o", "--output", default=DEFAULT_SAVE_PATH, help="save folder")
+    cmd.add_argument("-r", "--recursive", action="store_true", help="descend into sub-directories")
+    cmd.add_argument("--mode", choices=list(COMPOSITE_MODES), default="rgba",
+                     help="rgba: transparent cutout, cutout: cropped to the subject, jpg: flattened onto --background")
+    cmd.add_argument("--background", type=_hex_color, default=[255, 255, 255], help="e.g. #FFFFFF")
+    cmd.add_argument("--encoder", choices=list(OUTPUT_ENCODERS), default=OUTPUT_ENCODER,
+                     help="encoder for rgba/cutout outputs")
+    cmd.add_argument("--batch-size", type=int, default=16, help="same-size masks blended together")
+
+    cmd = commands.add_parser("smart-crop", parents=[common], help="crop around the face or subject")
+    cmd.add_argument("--ratio", type=_pair(":"), action="append",
+                     help="aspect ratio, e.g. 4:3; repeat for several crops from one pass (default 1:1)")
+    cmd.add_argument("--size", type=_pair("x"), action="append",
+                     help="pixel size, e.g. 800x1200: cropped to its ratio, then resized; repeatable")
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+
+    cmd = commands.add_parser("fast-crop", parents=[common], help="center crop to a fixed size")
+    cmd.add_argument("--size", type=_pair("x"), required=True, help="e.g. 200x300")
+
+    cmd = commands.add_parser("resize", parents=[common], help="resize to a fixed size")
+    cmd.add_argument("--size", type=_pair("x"), required=True, help="e.g. 800x600")
+
+    cmd = commands.add_parser("to-jpg", parents=[common], help="convert to JPG over a background color")
+    cmd.add_argument("--background", type=_hex_color, default=[255, 255, 255], help="e.g. #FFFFFF")
+
+    cmd = commands.add_parser("rotate", parents=[common], help="rotate counter-clockwise")
+    cmd.add_argument("--angle", type=int, required=True)
+    cmd.add_argument("--exif-orientation", action="store_true",
+                     help="for JPEGs and multiples of 90, only rewrite the EXIF orientation tag (no re-encode)")
+
+    cmd = commands.add_parser("flip", parents=[common], help="mirror images")
+    cmd.add_argument("--direction", choices=["horizontal", "vertical"], required=True)
+    cmd.add_argument("--exif-orientation", action="store_true",
+                     help="for JPEGs, only rewrite the EXIF orientation tag (no re-encode)")
+
+    cmd = commands.add_parser("chain", parents=[common], help="run several operations per image in memory")
+    _add_chain_arguments(cmd)
+    cmd.add_argument("--save-recipe", metavar="NAME", help="also save the chain as a recipe")
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+    cmd.add_argument("--refine", choices=list(REFINE_LEVELS), default=EDGE_REFINE)
+    cmd.add_argument("--large-image-mp", type=float, default=LARGE_IMAGE_MP)
+    cmd.add_argument("--animation-format", choices=ANIMATION_FORMATS, default=ANIMATION_FORMAT)
+
+    commands.add_parser("recipes", help="list saved recipes")
+
+    cmd = commands.add_parser("serve", help="run a local HTTP background-removal service")
+    cmd.add_argument("--host", default=SERVE_HOST)
+    cmd.add_argument("--port", type=int, default=SERVE_PORT)
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+    cmd.add_argument("--refine", choices=list(REFINE_LEVELS), default=EDGE_REFINE)
+    cmd.add_argument("--batch-window-ms", type=float, default=SERVE_BATCH_WINDOW_MS,
+                     help="how long the first waiting request holds the batch open")
+    cmd.add_argument("--max-batch", type=int, default=SERVE_MAX_BATCH)
+
+    cmd = commands.add_parser("loadgen", help="load-test a running service")
+    cmd.add_argument("inputs", nargs="+", help="image files, directories or glob patterns to send")
+    cmd.add_argument("--url", default=f"http://{SERVE_HOST}:{SERVE_PORT}")
+    cmd.add_argument("--endpoint", choices=["/remove-bg", "/smart-crop"], default="/remove-bg")
+    cmd.add_argument("-c", "--concurrency", type=int, default=8)
+    cmd.add_argument("-n", "--requests", type=int, default=100)
+
+    cmd = commands.add_parser("watch", help="keep watching a folder and process new images as they arrive")
+    cmd.add_argument("input_dir")
+    cmd.add_argument("-o", "--output", default=DEFAULT_SAVE_PATH, help="save folder")
+    _add_chain_arguments(cmd)
+    cmd.add_argument("-w", "--workers", type=int, default=1, help="worker threads sharing the warm sessions")
+    cmd.add_argument("-r", "--recursive", action="store_true", help="watch sub-directories too")
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+    cmd.add_argument("--refine", choices=list(REFINE_LEVELS), default=EDGE_REFINE)
+    cmd.add_argument("--large-image-mp", type=float, default=LARGE_IMAGE_MP)
+    cmd.add_argument("--animation-format", choices=ANIMATION_FORMATS, default=ANIMATION_FORMAT)
+    cmd.add_argument("--mask-cache-mb", type=int, default=MASK_CACHE_MB, help="mask cache budget (0 disables)")
+    cmd.add_argument("--poll", type=float, default=WATCH_POLL_SECONDS, help="seconds between folder scans")
+    cmd.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS,
+                     help="seconds a file must stay unchanged before it is picked up")
+    cmd.add_argument("--queue-size", type=int, default=WATCH_QUEUE_SIZE, help="files queued before backpressure")
+    cmd.add_argument("--encoder", choices=list(OUTPUT_ENCODERS), default=OUTPUT_ENCODER,
+                     help="encoder for the final output of the chain")
+
+    cmd = commands.add_parser("benchmark-encoders", help="compare encode time and size of the output encoders")
+    cmd.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    cmd.add_argument("--model", default=DEFAULT_MODEL)
+    cmd.add_argument("--sample", type=int, default=BENCHMARK_SAMPLE_SIZE)
+
+    cmd = commands.add_parser("benchmark-decode", help="compare full and reduced decodes for thumbnails, "
+                                                       "preview and face detection")
+    cmd.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    cmd.add_argument("--sample", type=int, default=BENCHMARK_SAMPLE_SIZE)
+    return parser
+
+
+def _add_chain_arguments(cmd):
+    chain = cmd.add_mutually_exclusive_group(required=True)
+    chain.add_argument("--chain", type=parse_chain,
+                       help="comma-separated steps, e.g. remove-bg,smart-crop=1:1 "
+                            "(also fast-crop=WxH, resize=WxH, to-jpg=#RRGGBB, rotate=DEG, flip=horizontal|vertical)")
+    chain.add_argument("--recipe", type=_recipe, dest="chain", help="name or .json file of a saved recipe")
+
+
+def _recipe(name):
+    try:
+        return parse_chain(load_recipe(name))
+    except (OSError, ValueError, KeyError) as e:
+        raise argparse.ArgumentTypeError(f"cannot load recipe {name!r}: {e}")
+
+
+def parse_chain(spec):
+    """
+    Parse "remove-bg,smart-crop=1:1" into [(operation, params), ...]. Model
+    options are filled in later from --model/--refine/--large-image-mp.
+    """
+    steps = []
+    for token in spec.split(","):
+        command, _, value = token.strip().partition("=")
+        if command == "remove-bg":
+            steps.append(("remove_bg", {}))
+        elif command == "smart-crop":
+            steps.append(("smart_crop", {"ratio": _pair(":")(value or "1:1")}))
+        elif command in ("fast-crop", "resize"):
+            steps.append((command.replace("-", "_"), {"size": _pair("x")(value)}))
+        elif command == "to-jpg":
+            steps.append(("convert_jpg", {"background": _hex_color(value or "#FFFFFF")}))
+        elif command == "rotate":
+            try:
+                steps.append(("rotate", {"angle": int(value)}))
+            except ValueError:
+                raise argparse.ArgumentTypeError(f"rotate needs an angle, e.g. rotate=90, got {token!r}")
+        elif command == "flip" and value in ("horizontal", "vertical"):
+            steps.append(("flip", {"flip_type": value}))
+        else:
+            raise argparse.ArgumentTypeError(f"unknown chain step {token!r}")
+    return steps
+
+
+def cli_operation(args):
+    """
+    Map parsed arguments to (operation, params) - the same names and parameter
+    dicts the GUI records in the manifest, so both skip each other's outputs.
+    """
+    if args.command == "remove-bg":
+        return "remove_bg", {"model": args.model, "refine": args.refine, "large_image_mp": args.large_image_mp,
+                             "animation_format": args.animation_format, "encoder": args.encoder,
+                             "output_mode": args.output_mode}
+    if args.command == "fast-crop":
+        return "fast_crop", {"size": args.size, "encoder": args.encoder}
+    if args.command == "resize":
+        return "resize", {"size": args.size, "encoder": args.encoder}
+    if args.command == "to-jpg":
+        return "convert_jpg", {"background": args.background}
+    if args.command == "rotate":
+        return "rotate", {"angle": args.angle, "encoder": args.encoder,
+                          "orientation_only": ORIENTATION_ONLY or args.exif_orientation}
+    if args.command == "chain":
+        return "chain", {"steps": chain_steps(args.chain, args.model, args.refine, args.large_image_mp,
+                                              args.animation_format, args.encoder)}
+    return "flip", {"flip_type": args.direction, "encoder": args.encoder,
+                    "orientation_only": ORIENTATION_ONLY or args.exif_orientation}
+
+
+def smart_crop_main(args):
+    """
+    smart-crop: every --ratio and --size of an image comes from one decode and
+    one subject search. An input is redone unless all of its crops are up to date.
+    """
+    filepaths = collect_inputs(args.inputs, args.recursive)
+    if not filepaths:
+        emit("error", error="No input images matched.")
+        return EXIT_NO_INPUTS
+    ratios = args.ratio or ([] if args.size else [[1, 1]])
+    variants = crop_variants(ratios, args.size or [], args.model, args.encoder)
+    os.makedirs(args.output, exist_ok=True)
+    manifest = Manifest(args.output)
+    pending = [f for f in filepaths if args.force or not all(
+        manifest.is_up_to_date(f, "smart_crop", params,
+                               os.path.join(args.output, output_name(f, operation_suffix("smart_crop", params))))
+        for params in variants)]
+    skipped = len(filepaths) - len(pending)
+    emit("start", operation="smart_crop", variants=variants, total=len(filepaths), skipped=skipped,
+         output=os.path.abspath(args.output))
+
+    started = time.perf_counter()
+    done, failed = skipped, 0
+    stats = LocalizerStats()
+    try:
+        for filepath, output_paths, error in run_smart_crop_batch(pending, args.output, variants, max(1, args.workers),
+                                                                  cache_mb=args.mask_cache_mb, stats=stats):
+            done += 1
+            if error is not None:
+                failed += 1
+                emit("failed", input=filepath, error=str(error), done=done, total=len(filepaths))
+                continue
+            for params, output_path in zip(variants, output_paths):
+                manifest.record(filepath, "smart_crop", params, output_path)
+            emit("processed", input=filepath, outputs=output_paths, done=done, total=len(filepaths))
+    except KeyboardInterrupt:
+        emit("interrupted", done=done, total=len(filepaths))
+        return EXIT_INTERRUPTED
+
+    emit("finished", processed=done - skipped - failed, failed=failed, skipped=skipped,
+         seconds=round(time.perf_counter() - started, 3), localizer=stats.as_dict())
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+def emit(event, **fields):
+    print(json.dumps({"event": event, **fields}), flush=True)
+
+
+def watch_main(args):
+    steps = chain_steps(args.chain, args.model, args.refine, args.large_image_mp, args.animation_format, args.encoder)
+    watcher = FolderWatcher(args.input_dir, args.output, steps, max(1, args.workers), args.recursive,
+                            cache_mb=args.mask_cache_mb, poll_seconds=args.poll, settle_seconds=args.settle,
+                            queue_size=max(1, args.queue_size), on_event=emit)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+        emit("stopped", processed=watcher.processed, failed=watcher.failed)
+        return EXIT_INTERRUPTED
+    return EXIT_OK
+
+
+def serve_main(args):
+    ort_settings = load_ort_settings()
+    server = BackgroundRemovalServer((args.host, args.port), create_session(args.model, ort_settings),
+                                     args.refine, args.batch_window_ms, max(1, args.max_batch), ort_settings)
+    emit("serving", url=f"http://{args.host}:{server.server_port}", model=args.model,
+         batch_window_ms=args.batch_window_ms, max_batch=args.max_batch)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        emit("stopped", **server.stats())
+        return EXIT_INTERRUPTED
+    finally:
+        server.server_close()
+    return EXIT_OK
+
+
+def frames_main(args):
+    """
+    remove-bg --frames: every input directory is one animation of numbered frames.
+    """
+    if args.output_mode != "cutout":
+        emit("error", error="--frames writes cutout animations only; drop --output-mode.")
+        return EXIT_USAGE
+    folders = [path for path in args.inputs if os.path.isdir(path)]
+    if not folders:
+        emit("error", error="--frames needs one or more frame folders.")
+        return EXIT_NO_INPUTS
+    os.makedirs(args.output, exist_ok=True)
+    params = {"model": args.model, "refine": args.refine, "animation_format": args.animation_format,
+              "encoder": args.encoder, "frames": True}
+    manifest = Manifest(args.output)
+    pending = [folder for folder in folders if args.force or not manifest.is_up_to_date(
+        folder, "remove_bg", params, animation_output_path(folder, args.output, args.animation_format))]
+    skipped = len(folders) - len(pending)
+    emit("start", operation="remove_bg", params=params, total=len(folders), skipped=skipped,
+         output=os.path.abspath(args.output))
+    session = create_session(args.model, load_ort_settings()) if pending else None
+    failed = 0
+    for folder in pending:
+        started = time.perf_counter()
+        stats = {}
+        try:
+            output_path = remove_background_animation(folder, args.output, session, args.refine,
+                                                      args.animation_format, max(1, args.batch_size), stats=stats,
+                                                      encoder=args.encoder)
+            manifest.record(folder, "remove_bg", params, output_path)
+            emit("processed", input=folder, output=output_path, seconds=round(time.perf_counter() - started, 3),
+                 **stats)
+        except Exception as e:
+            failed += 1
+            emit("failed", input=folder, error=str(e))
+    emit("finished", processed=len(pending) - failed, failed=failed, skipped=skipped)
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+def composite_main(args):
+    mask_paths = [f for f in collect_inputs(args.inputs, args.recursive) if f.lower().endswith("_mask.png")]
+    if not mask_paths:
+        emit("error", error="No _mask.png files matched.")
+        return EXIT_NO_INPUTS
+    os.makedirs(args.output, exist_ok=True)
+    emit("start", operation="composite", mode=args.mode, total=len(mask_paths), output=os.path.abspath(args.output))
+    started = time.perf_counter()
+    failed = 0
+    for done, (mask_path, output_path, error) in enumerate(
+            composite_batch(mask_paths, args.output, args.mode, args.background, args.encoder,
+                            max(1, args.batch_size)), start=1):
+        if error is not None:
+            failed += 1
+            emit("failed", input=mask_path, error=str(error), done=done, total=len(mask_paths))
+        else:
+            emit("processed", input=mask_path, output=output_path, done=done, total=len(mask_paths))
+    emit("finished", processed=len(mask_paths) - failed, failed=failed,
+         seconds=round(time.perf_counter() - started, 3))
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+def cli_main(argv):
+    args = build_cli_parser().parse_args(argv)
+    if args.command == "loadgen":
+        filepaths = collect_inputs(args.inputs)
+        if not filepaths:
+            emit("error", error="No input images matched.")
+            return EXIT_NO_INPUTS
+        emit("loadgen", **run_load_test(args.url, filepaths, max(1, args.concurrency), max(1, args.requests),
+                                        args.endpoint))
+        return EXIT_OK
+    if not local_license_valid():
+        emit("error", error="No validated license found; activate one in the GUI first.")
+        return EXIT_UNLICENSED
+    if args.command == "serve":
+        return serve_main(args)
+    if args.command == "benchmark-encoders":
+        filepaths = collect_inputs(args.inputs)[:max(1, args.sample)]
+        if not filepaths:
+            emit("error", error="No input images matched.")
+            return EXIT_NO_INPUTS
+        cutouts = encoder_benchmark_images(filepaths, create_session(args.model, load_ort_settings()))
+        for encoder, (seconds, size) in benchmark_encoders(cutouts).items():
+            emit("encoder", encoder=encoder, ms_per_image=round(seconds * 1000, 2), bytes_per_image=round(size))
+        return EXIT_OK
+    if args.command == "benchmark-decode":
+        filepaths = collect_inputs(args.inputs)[:max(1, args.sample)]
+        if not filepaths:
+            emit("error", error="No input images matched.")
+            return EXIT_NO_INPUTS
+        for task, (full, reduced, full_bytes, reduced_bytes) in benchmark_decode(filepaths).items():
+            emit("decode", task=task, full_ms=round(full * 1000, 2), reduced_ms=round(reduced * 1000, 2),
+                 full_bytes=full_bytes, reduced_bytes=reduced_bytes)
+        return EXIT_OK
+    if args.command == "composite":
+        return composite_main(args)
+    if args.command == "recipes":
+        for name in list_recipes():
+            emit("recipe", name=name, chain=load_recipe(name))
+        return EXIT_OK
+    if args.command == "chain" and args.save_recipe:
+        save_recipe(args.save_recipe, chain_spec(args.chain))
+        emit("recipe_saved", name=args.save_recipe, path=recipe_path(args.save_recipe))
+    if args.command == "watch":
+        if not os.path.isdir(args.input_dir):
+            emit("error", error=f"Not a folder: {args.input_dir}")
+            return EXIT_NO_INPUTS
+        return watch_main(args)
+    if getattr(args, "frames", False):
+        return frames_main(args)
+    if args.command == "smart-crop":
+        return smart_crop_main(args)
+
+    filepaths = collect_inputs(args.inputs, args.recursive)
+    if not filepaths:
+        emit("error", error="No input images matched.")
+        return EXIT_NO_INPUTS
+
+    operation, params = cli_operation(args)
+    os.makedirs(args.output, exist_ok=True)
+    manifest = Manifest(args.output)
+    pending = [f for f in filepaths if args.force or not manifest.is_up_to_date(
+        f, operation, params, os.path.join(args.output, output_name(f, operation_suffix(operation, params, f))))]
+    skipped = len(filepaths) - len(pending)
+    emit("start", operation=operation, params=params, total=len(filepaths), skipped=skipped,
+         workers=args.workers, output=os.path.abspath(args.output))
+
+    started = time.perf_counter()
+    done, failed = skipped, 0
+    try:
+        results = run_operation_batch(operation, pending, args.output, params, max(1, args.workers),
+                                      getattr(args, "batch_size", BATCH_SIZE), cache_mb=args.mask_cache_mb)
+        for filepath, output_path, error in results:
+            done += 1
+            if error is not None:
+                failed += 1
+                emit("failed", input=filepath, error=str(error), done=done, total=len(filepaths))
+            else:
+                manifest.record(filepath, operation, params, output_path)
+                emit("processed", input=filepath, output=output_path, done=done, total=len(filepaths))
+    except KeyboardInterrupt:
+        emit("interrupted", done=done, total=len(filepaths))
+        return EXIT_INTERRUPTED
+
+    emit("finished", processed=done - skipped - failed, failed=failed, skipped=skipped,
+         seconds=round(time.perf_counter() - started, 3))
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
 # ---------------------------------------------------------------------
 #               Run the application if this file is main
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    # Any arguments select the headless command line, e.g. `app.py resize photos/ --size 800x600`
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
     root = ThemedTk(theme="arc")
     app = ImageProcessorApp(root)
     root.mainloop()
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import app  # noqa: E402
+
+
+def run_remove_bg(*args):
+    result = subprocess.run([sys.executable, os.path.join(REPO, "app.py"), "remove-bg", *args],
+                            cwd=REPO, capture_output=True, text=True)
+    events = [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+    assert result.returncode == app.EXIT_OK, result.stdout + result.stderr
+    return events
+
+
+@pytest.fixture
+def animation(tmp_path):
+    path = tmp_path / "spinner.gif"
+    frames = [Image.new("RGB", (48, 48), (i * 60, 120, 200)) for i in range(3)]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+    return str(path)
+
+
+@pytest.mark.parametrize("encoder", list(app.OUTPUT_ENCODERS))
+@pytest.mark.parametrize("animation_format", app.ANIMATION_FORMATS)
+def test_animation_rerun_is_skipped(tmp_path, animation, animation_format, encoder):
+    output = str(tmp_path / "out")
+    args = [animation, "-o", output, "--animation-format", animation_format, "--encoder", encoder]
+    first = run_remove_bg(*args)
+    processed = [event for event in first if event["event"] == "processed"]
+    assert processed[0]["output"] == app.animation_output_path(animation, output, animation_format)
+
+    start = next(event for event in run_remove_bg(*args) if event["event"] == "start")
+    assert start["skipped"] == start["total"]